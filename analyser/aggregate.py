@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .table import MISSING_TS, MessageTable, hour_index, month_index, weekday_index
+
+# bucket name -> fixed number of buckets (None: month range of the data)
+BUCKETS: Dict[str, Optional[int]] = {"month": None, "weekday": 7, "hour": 24}
+_BUCKET_OF = {"month": month_index, "weekday": weekday_index, "hour": hour_index}
+
+Predicate = Callable[[MessageTable], np.ndarray]
+
+
+@dataclass(frozen=True)
+class Count:
+    """
+    Declarative counter: dated rows matching `where`, bucketed by `by`,
+    summing the `weight` column (or counting rows when it is None).
+    `where` returns a boolean mask, or the matching row indices when it
+    picks a small slice (e.g. from table.by_action): then only those rows
+    are read.
+
+    Equal specs are computed once, so processors may share them.
+    """
+    by: str
+    where: Optional[Predicate] = None
+    weight: Optional[str] = None
+
+
+def aggregate(table: MessageTable, counts: Iterable[Count]) -> Dict[Count, pd.Series]:
+    """
+    Feed all counters from one walk over the table.
+
+    Bucket arrays and `where` masks are computed once and reused by every
+    counter that needs them. Month series cover a continuous range from
+    the first to the last matching month (zeros for gaps); weekday/hour
+    series always have 7/24 buckets.
+    """
+    masks: Dict[Optional[Predicate], np.ndarray] = {None: table.has_date}
+    out: Dict[Count, pd.Series] = {}
+
+    for c in dict.fromkeys(counts):
+        if c.by not in BUCKETS:
+            raise ValueError(f"unknown bucket: {c.by!r}")
+        mask = masks.get(c.where)
+        if mask is None:
+            mask = masks[c.where] = _selection(table, c.where)
+
+        if mask.dtype == bool:
+            keys = getattr(table, c.by)[mask]
+        else:
+            keys = _BUCKET_OF[c.by](table.ts[mask])
+        weights = getattr(table, c.weight)[mask] if c.weight else None
+        size = BUCKETS[c.by]
+
+        start = 0
+        if size is None:
+            if keys.size == 0:
+                out[c] = pd.Series(dtype="int64")
+                continue
+            start = int(keys.min())
+            keys = keys - start
+
+        values = np.bincount(keys, weights=weights, minlength=size or 0)
+        if weights is None or np.issubdtype(weights.dtype, np.integer):
+            values = values.astype(np.int64)
+        out[c] = pd.Series(values, index=np.arange(start, start + values.size))
+
+    return out
+
+
+def _selection(table: MessageTable, where: Predicate) -> np.ndarray:
+    """Dated rows matching `where`: a boolean mask, or row indices if `where` gave indices."""
+    sel = np.asarray(where(table))
+    if sel.dtype == bool:
+        return sel & table.has_date
+    return sel[table.ts[sel] != MISSING_TS]
+
+
+def merge_counts(counts: Sequence[Count], old: List[pd.Series], new: List[pd.Series]) -> List[pd.Series]:
+    """
+    Add up the series of `counts` computed on two slices of a chat.
+
+    Month series stay continuous over the union of both ranges.
+    """
+    out: List[pd.Series] = []
+    for c, a, b in zip(counts, old, new):
+        if a.empty or b.empty:
+            out.append(b if a.empty else a)
+            continue
+        s = a.add(b, fill_value=0).astype(np.result_type(a.dtype, b.dtype))
+        if BUCKETS[c.by] is None:
+            s = s.reindex(np.arange(s.index.min(), s.index.max() + 1), fill_value=0)
+        out.append(s)
+    return out
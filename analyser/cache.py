@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from dataclasses import fields
+from pathlib import Path
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .pipeline import load_table
+from .table import OPTIONAL_COLUMNS, MessageTable, PackedStrings, Unloaded, resolve_columns
+
+# Bump when MessageTable columns or their meaning change.
+CACHE_FORMAT = 2
+
+_HASH_CHUNK = 1 << 20
+
+
+def content_hash(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _save_strings(d: Path, name: str, strings: Any) -> None:
+    packed = strings if isinstance(strings, PackedStrings) else PackedStrings.pack(strings)
+    np.save(d / f"{name}.data.npy", packed.data)
+    np.save(d / f"{name}.offsets.npy", packed.offsets)
+
+
+def _open_strings(d: Path, name: str) -> PackedStrings:
+    return PackedStrings(
+        np.load(d / f"{name}.data.npy", mmap_mode="r"),
+        np.load(d / f"{name}.offsets.npy", mmap_mode="r"),
+    )
+
+
+def save_table(table: MessageTable, d: Path) -> None:
+    """Write every loaded column of the table as .npy files into directory `d`."""
+    kinds: Dict[str, str] = {}
+    values: Dict[str, int] = {}
+    for f in fields(table):
+        v = getattr(table, f.name)
+        if isinstance(v, Unloaded):
+            continue
+        if isinstance(v, int):
+            values[f.name] = v
+            kinds[f.name] = "int"
+        elif isinstance(v, np.ndarray):
+            np.save(d / f"{f.name}.npy", v)
+            kinds[f.name] = "array"
+        elif isinstance(v, pd.Categorical):
+            np.save(d / f"{f.name}.npy", np.asarray(v.codes, dtype=np.int32))
+            _save_strings(d, f"{f.name}.categories", [str(c) for c in v.categories])
+            kinds[f.name] = "categorical"
+        else:
+            _save_strings(d, f.name, v)
+            kinds[f.name] = "strings"
+    meta = {"format": CACHE_FORMAT, "columns": kinds, "values": values}
+    (d / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+
+def open_table(d: Path, columns: Optional[AbstractSet[str]] = None) -> MessageTable:
+    """
+    Open a saved table; arrays and texts are memory-mapped, not read.
+    With `columns` the other optional columns are not opened at all.
+    """
+    meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+    want = resolve_columns(columns)
+    cols: Dict[str, Any] = {name: Unloaded(name) for name in OPTIONAL_COLUMNS}
+    for name, kind in meta["columns"].items():
+        if name in cols and name not in want:
+            continue
+        if kind == "int":
+            cols[name] = meta["values"][name]
+        elif kind == "array":
+            cols[name] = np.load(d / f"{name}.npy", mmap_mode="r")
+        elif kind == "categorical":
+            cats = pd.Index(list(_open_strings(d, f"{name}.categories")), dtype=object)
+            cols[name] = pd.Categorical.from_codes(np.load(d / f"{name}.npy", mmap_mode="r"), categories=cats)
+        else:
+            cols[name] = _open_strings(d, name)
+    return MessageTable(**cols)
+
+
+class TableCache:
+    """
+    On-disk cache of parsed exports.
+
+    Entries are keyed by the export's content hash (plus CACHE_FORMAT);
+    an export split into several files by the hash of their hashes. A small
+    per-path record keeps (size, mtime) -> hash, so unchanged files are not
+    even re-read to be hashed.
+    """
+
+    def __init__(self, root: Path, rebuild: bool = False):
+        self.root = root
+        self.rebuild = rebuild
+
+    def _path_record(self, path: Path) -> Path:
+        key = hashlib.sha1(str(path.resolve()).encode("utf-8")).hexdigest()
+        return self.root / "paths" / f"{key}.json"
+
+    def fingerprint(self, path: Path) -> str:
+        """Content hash of `path`, re-read only when its size or mtime changed."""
+        st = path.stat()
+        rec_path = self._path_record(path)
+        try:
+            rec = json.loads(rec_path.read_text(encoding="utf-8"))
+            if rec["size"] == st.st_size and rec["mtime_ns"] == st.st_mtime_ns:
+                return rec["hash"]
+        except (OSError, ValueError, KeyError):
+            rec = None
+
+        digest = content_hash(path)
+        if rec and rec.get("hash") != digest:
+            self._drop_entry(rec["hash"])
+        rec_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = rec_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps({
+            "path": str(path.resolve()),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "hash": digest,
+        }), encoding="utf-8")
+        os.replace(tmp, rec_path)
+        return digest
+
+    def export_fingerprint(self, paths: Union[Path, Sequence[Path]]) -> str:
+        """fingerprint() of a single file; combined fingerprints of the shards of a split export."""
+        if isinstance(paths, Path):
+            return self.fingerprint(paths)
+        if len(paths) == 1:
+            return self.fingerprint(paths[0])
+        h = hashlib.blake2b(digest_size=16)
+        for p in paths:
+            h.update(self.fingerprint(p).encode("ascii"))
+        return h.hexdigest()
+
+    def _entry(self, digest: str) -> Path:
+        return self.root / "tables" / f"{digest}-v{CACHE_FORMAT}"
+
+    def _drop_entry(self, digest: str) -> None:
+        shutil.rmtree(self._entry(digest), ignore_errors=True)
+
+    def ensure(self, path: Union[Path, Sequence[Path]], workers: int = 1) -> Path:
+        """Return the cache entry of `path` (or shards), parsing the export if needed."""
+        entry = self._entry(self.export_fingerprint(path))
+        if (entry / "meta.json").exists() and not self.rebuild:
+            return entry
+
+        tmp = self.root / "tables" / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir(parents=True)
+        try:
+            save_table(load_table(path, workers=workers), tmp)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        except OSError:
+            # another process has just published the same entry
+            if not (entry / "meta.json").exists():
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return entry
+
+
+class ResultCache:
+    """
+    Charts rendered earlier, keyed by everything that determines them.
+
+    The key covers the export's content hash, processor id and version,
+    the kwargs it is run with and the anonymity mode, so a hit can be
+    copied to the output instead of running the processor. Entries are
+    grouped per export; with `chat`, the entries of the export that chat
+    was last run on are dropped once its export has changed.
+    """
+
+    def __init__(self, root: Path, export: str, rebuild: bool = False, chat: Optional[str] = None):
+        self.root = root / "results"
+        self.export = export
+        self.rebuild = rebuild
+        if chat is not None:
+            self._supersede(chat)
+
+    def _supersede(self, chat: str) -> None:
+        """Record `export` as the chat's current one; remove the entries of its previous export."""
+        key = hashlib.sha1(chat.encode("utf-8")).hexdigest()
+        rec_path = self.root / "chats" / f"{key}.json"
+        try:
+            previous = json.loads(rec_path.read_text(encoding="utf-8"))["export"]
+        except (OSError, ValueError, KeyError):
+            previous = None
+        if previous == self.export:
+            return
+        if previous:
+            shutil.rmtree(self.root / previous, ignore_errors=True)
+        rec_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = rec_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps({"chat": chat, "export": self.export}), encoding="utf-8")
+        os.replace(tmp, rec_path)
+
+    def key(self, processor_id: str, version: int, kwargs: Dict[str, Any], anon: bool) -> str:
+        blob = json.dumps({
+            "export": self.export,
+            "processor": processor_id,
+            "version": version,
+            "kwargs": kwargs,
+            "anon": anon,
+        }, sort_keys=True, default=repr)
+        return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+    def restore(self, key: str, out_dir: Path) -> Optional[List[str]]:
+        """Copy the artifacts of `key` into `out_dir`; None on a miss."""
+        entry = self.root / self.export / key
+        if self.rebuild:
+            return None
+        try:
+            files = json.loads((entry / "meta.json").read_text(encoding="utf-8"))["files"]
+        except (OSError, ValueError, KeyError):
+            return None
+        for name in files:
+            tmp = out_dir / f".{name}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(entry / name, tmp)
+            os.replace(tmp, out_dir / name)
+        return files
+
+    def store(self, key: str, src: Path) -> None:
+        """Save the files of directory `src` (one processor's output) under `key`."""
+        entry = self.root / self.export / key
+        tmp = self.root / self.export / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir(parents=True)
+        try:
+            files = sorted(p.name for p in src.iterdir() if p.is_file())
+            for name in files:
+                shutil.copyfile(src / name, tmp / name)
+            (tmp / "meta.json").write_text(json.dumps({"files": files}), encoding="utf-8")
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        except OSError:
+            if not (entry / "meta.json").exists():
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def as_table(loaded: Any, columns: Optional[AbstractSet[str]] = None) -> MessageTable:
+    """Loader result -> table: cache entries are opened (with `columns` only), tables pass through."""
+    return open_table(loaded, columns) if isinstance(loaded, Path) else loaded
+
+
+def purge_cache(root: Optional[Path]) -> None:
+    if root and root.exists():
+        shutil.rmtree(root)
@@ -1,24 +1,100 @@
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
 
 from yaml import safe_load
 
 ALLOWED_CHANNEL_TYPES = {"anonymous", "public", "unknown"}
 
+# relative window bound: "90d" / "12w" before the chat's last message
+_RELATIVE = re.compile(r"^\s*(\d+)\s*([dw])\s*$")
+_UNIT_SECONDS = {"d": 86400, "w": 7 * 86400}
+
+
+def _bound(value: Any, what: str) -> Optional[str]:
+    """Normalized window bound: ISO date/datetime string, relative "Nd"/"Nw", or None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds")
+    if isinstance(value, date):  # YAML reads unquoted 2024-01-01 as a date
+        return value.isoformat()
+    value = str(value).strip()
+    if _RELATIVE.match(value):
+        return value
+    try:
+        np.datetime64(value, "s")
+    except ValueError:
+        raise SystemExit(f"{what}: expected a date (2024-01-31), date-time or 90d/12w, got {value!r}")
+    return value
+
+
+def _seconds(value: str, end: bool, last: int) -> int:
+    """Table timestamp (wall-clock seconds) of a bound; a date as `end` covers its whole day."""
+    rel = _RELATIVE.match(value)
+    if rel:
+        return last - int(rel.group(1)) * _UNIT_SECONDS[rel.group(2)]
+    t = int(np.datetime64(value, "s").astype(np.int64))
+    if end and len(value) == 10:
+        t += 86400
+    return t
+
+
+@dataclass(frozen=True)
+class Window:
+    """
+    Date range a graphic is computed on: `start` and `end` are inclusive
+    ISO dates or date-times (an end date covers its whole day), or
+    "90d"/"12w": that long before the chat's last message.
+    """
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+    @property
+    def relative(self) -> bool:
+        return any(b is not None and _RELATIVE.match(b) for b in (self.start, self.end))
+
+    def bounds(self, last_ts: int) -> Tuple[Optional[int], Optional[int]]:
+        """[start, stop) in table timestamps; `last_ts` anchors relative bounds."""
+        return (None if self.start is None else _seconds(self.start, False, last_ts),
+                None if self.end is None else _seconds(self.end, True, last_ts))
+
+
+def parse_window(raw: Any, what: str) -> Optional[Window]:
+    """`{from: ..., to: ...}` -> Window; None when absent or unbounded."""
+    if raw is None:
+        return None
+    if not isinstance(raw, dict):
+        raise SystemExit(f"{what}: must be a mapping with 'from' and/or 'to'")
+    w = Window(_bound(raw.get("from"), f"{what}.from"), _bound(raw.get("to"), f"{what}.to"))
+    return w if (w.start or w.end) else None
+
 
 @dataclass
 class ChatCfg:
-    file: str
+    file: str  # export file, directory of shards or glob pattern, relative to input_dir
     name: str
     channel_type: str
 
+    @property
+    def key(self) -> str:
+        """`file` usable as a directory name for results and saved state."""
+        if not re.search(r"[*?\[]", self.file):
+            return self.file.strip("/")
+        return re.sub(r"[*?\[\]/\\]", "_", self.file)
+
 
 @dataclass
 class GraphicCfg:
     """Single graphic configuration."""
     id: str
     anon: bool  # whether this graphic should run for anonymous channels
+    params: Dict[str, Any] = field(default_factory=dict)  # processor settings (kwargs of run)
+    window: Optional[Window] = None  # dates to analyse (None = whole history)
 
 
 @dataclass
@@ -28,6 +104,12 @@ class AppCfg:
     graphics: List[GraphicCfg]
     chats: List[ChatCfg]
     need_make_web_page: bool
+    workers: int = 1  # processors run in parallel per chat (0 = one per CPU)
+    chats_in_flight: int = 1  # chats held at once; >1 loads next exports in background
+    cache_dir: Optional[Path] = None  # cache of parsed exports (None = disabled)
+    state_dir: Optional[Path] = None  # saved aggregates for incremental runs (None = disabled)
+    metrics_file: Optional[Path] = None  # Prometheus textfile with run metrics (None = disabled)
+    window: Optional[Window] = None  # default window of every graphic (None = whole history)
 
 
 def load_app_cfg(cfg_path: Path) -> AppCfg:
@@ -36,11 +118,13 @@ def load_app_cfg(cfg_path: Path) -> AppCfg:
 
     Supports two graphic formats:
       - short form: "id"
-      - object form: { id: "...", anon: true|false }
+      - object form: { id: "...", anon: true|false, params: {...} }
     Backward compatibility: per-graphic key "run_on_anonymous" is also accepted.
     Defaults can be provided as:
       defaults:
         run_on_anonymous: false
+    A top-level `window: {from: ..., to: ...}` limits every graphic to a
+    date range; a graphic's own `window` replaces it.
     """
     if not cfg_path.exists():
         raise SystemExit(f"Config file not found: {cfg_path}")
@@ -54,6 +138,7 @@ def load_app_cfg(cfg_path: Path) -> AppCfg:
     # Defaults
     defaults = raw.get("defaults") or {}
     default_anon = bool(defaults.get("run_on_anonymous", False))
+    window = parse_window(raw.get("window"), "config.window")
 
     # Graphics
     graphics_raw = raw.get("graphics", [])
@@ -66,7 +151,7 @@ def load_app_cfg(cfg_path: Path) -> AppCfg:
             gid = g.strip()
             if not gid:
                 raise SystemExit(f"graphics[{i}]: empty id")
-            graphics.append(GraphicCfg(id=gid, anon=default_anon))
+            graphics.append(GraphicCfg(id=gid, anon=default_anon, window=window))
         elif isinstance(g, dict):
             gid = str(g.get("id", "")).strip()
             if not gid:
@@ -78,7 +163,12 @@ def load_app_cfg(cfg_path: Path) -> AppCfg:
                 anon = bool(g.get("run_on_anonymous"))
             else:
                 anon = default_anon
-            graphics.append(GraphicCfg(id=gid, anon=anon))
+            params = g.get("params") or {}
+            if not isinstance(params, dict):
+                raise SystemExit(f"graphics[{i}]: 'params' must be a mapping")
+            own = parse_window(g.get("window"), f"graphics[{i}].window")
+            graphics.append(GraphicCfg(id=gid, anon=anon, params=params,
+                                       window=own if "window" in g else window))
         else:
             raise SystemExit(f"graphics[{i}]: invalid item type {type(g).__name__}")
 
@@ -102,10 +192,29 @@ def load_app_cfg(cfg_path: Path) -> AppCfg:
 
     need_web = bool(raw.get("need_make_web_page", False))
 
+    cache_dir = Path(raw["cache_dir"]) if raw.get("cache_dir") else None
+    state_dir = Path(raw["state_dir"]) if raw.get("state_dir") else None
+    metrics_file = Path(raw["metrics_file"]) if raw.get("metrics_file") else None
+
+    try:
+        workers = int(raw.get("workers", 1))
+    except (TypeError, ValueError):
+        raise SystemExit("config.workers must be an integer")
+    try:
+        chats_in_flight = max(1, int(raw.get("chats_in_flight", 1)))
+    except (TypeError, ValueError):
+        raise SystemExit("config.chats_in_flight must be an integer")
+
     return AppCfg(
         input_dir=input_dir,
         output_dir=output_dir,
         graphics=graphics,
         chats=chats,
         need_make_web_page=need_web,
+        workers=workers,
+        chats_in_flight=chats_in_flight,
+        cache_dir=cache_dir,
+        state_dir=state_dir,
+        metrics_file=metrics_file,
+        window=window,
     )
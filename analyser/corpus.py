@@ -0,0 +1,124 @@
+import multiprocessing as mp
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё]+(?:-[A-Za-zА-Яа-яЁё]+)?", re.U)
+
+# below this many texts workers cost more than they save
+_PARALLEL_MIN_TEXTS = 200_000
+_CHUNK = 100_000
+
+
+def norm(w: str) -> str:
+    return w.lower().replace("ё", "е")
+
+
+@dataclass
+class Corpus:
+    """
+    Words of every message of a chat, tokenized once for all text processors.
+
+    `vocab` holds the normalized forms (lowercase, ё -> е), a token is its
+    index there. The tokens of row i are tokens[offsets[i]:offsets[i + 1]];
+    rows without text are empty.
+    """
+    vocab: List[str]
+    tokens: np.ndarray      # int32
+    offsets: np.ndarray     # int64, one per row + 1
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def doc(self, row: int) -> np.ndarray:
+        return self.tokens[self.offsets[row]:self.offsets[row + 1]]
+
+    def take(self, rows: Union[slice, np.ndarray]) -> "Corpus":
+        """Corpus of `rows` with the same vocabulary; a row range shares the token array."""
+        if isinstance(rows, slice):
+            offsets = self.offsets[rows.start:rows.stop + 1]
+            return Corpus(self.vocab, self.tokens[offsets[0]:offsets[-1]], offsets - offsets[0])
+        lengths = np.diff(self.offsets)[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # position of every kept token in the old token array
+        at = np.repeat(self.offsets[:-1][rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return Corpus(self.vocab, self.tokens[at], offsets)
+
+    def term_counts(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Occurrences of every token id, over all rows or the rows of a boolean mask."""
+        tokens = self.tokens
+        if rows is not None:
+            tokens = tokens[np.repeat(rows, np.diff(self.offsets))]
+        return np.bincount(tokens, minlength=len(self.vocab))
+
+
+def _tokenize(texts: Sequence[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Local vocabulary, token ids and per-text token counts of `texts`."""
+    vocab: List[str] = []
+    by_norm: Dict[str, int] = {}
+    by_form: Dict[str, int] = {}  # raw form -> id: each form is normalized once
+    ids = array("i")
+    lengths = array("i")
+    for t in texts:
+        words = WORD_RE.findall(t) if t else []
+        got = list(map(by_form.get, words))
+        if None in got:
+            for k, (w, i) in enumerate(zip(words, got)):
+                if i is None:
+                    n = norm(w)
+                    i = by_norm.get(n)
+                    if i is None:
+                        i = by_norm[n] = len(vocab)
+                        vocab.append(n)
+                    by_form[w] = got[k] = i
+        ids.extend(got)
+        lengths.append(len(words))
+    return vocab, np.frombuffer(ids, dtype=np.int32), np.frombuffer(lengths, dtype=np.int32)
+
+
+# Texts being tokenized; forked workers inherit them instead of receiving them.
+_SHARED: Dict[str, Any] = {}
+
+
+def _tokenize_chunk(bounds: Tuple[int, int]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    start, stop = bounds
+    return _tokenize(_SHARED["texts"][start:stop])
+
+
+def build_corpus(texts: Sequence[str], workers: int = 1) -> Corpus:
+    """
+    Tokenize `texts` (one per table row).
+
+    Large chats are split into row ranges tokenized by forked workers; their
+    local vocabularies are merged in row order, so token ids are the same
+    as with a single process.
+    """
+    n = len(texts)
+    if workers <= 1 or n < _PARALLEL_MIN_TEXTS or "fork" not in mp.get_all_start_methods():
+        vocab, tokens, lengths = _tokenize(texts)
+    else:
+        bounds = [(i, min(i + _CHUNK, n)) for i in range(0, n, _CHUNK)]
+        _SHARED["texts"] = texts
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(bounds)),
+                                     mp_context=mp.get_context("fork")) as pool:
+                parts = list(pool.map(_tokenize_chunk, bounds))
+        finally:
+            _SHARED.clear()
+        index: Dict[str, int] = {}
+        remapped = []
+        for local, ids, _ in parts:
+            glob = np.fromiter((index.setdefault(w, len(index)) for w in local), dtype=np.int32, count=len(local))
+            remapped.append(glob[ids])
+        vocab = list(index)
+        tokens = np.concatenate(remapped)
+        lengths = np.concatenate([p[2] for p in parts])
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return Corpus(vocab=vocab, tokens=tokens, offsets=offsets)
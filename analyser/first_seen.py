@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .symbols import SYMBOLS
+from .table import MISSING_TS, MessageTable, month_index
+
+
+@dataclass
+class FirstSeenIndex:
+    """
+    When every author of a chat posted first: sorted user codes (SYMBOLS)
+    with their first timestamp, as two aligned arrays. Lookups are binary
+    searches; an update with newer messages only touches the users it
+    contains. Pickled with user ids instead of codes, which are per run.
+    """
+    keys: np.ndarray    # int32 SYMBOLS codes, sorted, unique
+    first: np.ndarray   # int64 timestamps
+
+    @classmethod
+    def from_table(cls, table: MessageTable) -> "FirstSeenIndex":
+        mask = table.has_date & (table.from_id.codes >= 0)
+        first = np.full(len(table.from_id.categories), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first, np.asarray(table.from_id.codes)[mask], table.ts[mask])
+        seen = first != np.iinfo(np.int64).max
+        return cls._sorted(SYMBOLS.mapping(table.from_id)[seen], first[seen])
+
+    @classmethod
+    def _sorted(cls, keys: np.ndarray, first: np.ndarray) -> "FirstSeenIndex":
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], first[order])
+
+    def __getstate__(self) -> dict:
+        return {"users": SYMBOLS.label(self.keys).tolist(), "first": self.first}
+
+    def __setstate__(self, state: dict) -> None:
+        index = self._sorted(SYMBOLS.intern(state["users"]), state["first"])
+        self.keys, self.first = index.keys, index.first
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _find(self, keys: np.ndarray) -> np.ndarray:
+        """Positions of `keys` in the index, -1 for unknown ones."""
+        pos = np.searchsorted(self.keys, keys)
+        inside = pos < len(self.keys)
+        hit = np.zeros(len(keys), dtype=bool)
+        hit[inside] = self.keys[pos[inside]] == keys[inside]
+        return np.where(hit, pos, -1)
+
+    def lookup(self, uid: str) -> Optional[int]:
+        """Timestamp of the first message of `uid`, None if it never posted."""
+        pos = self._find(np.asarray([SYMBOLS.lookup(uid)], dtype=np.int32))[0]
+        return int(self.first[pos]) if pos >= 0 else None
+
+    def lookup_many(self, uids: Sequence[str]) -> np.ndarray:
+        """First timestamps of `uids`, MISSING_TS for unknown ones."""
+        pos = self._find(np.asarray([SYMBOLS.lookup(u) for u in uids], dtype=np.int32))
+        out = np.full(len(pos), MISSING_TS, dtype=np.int64)
+        out[pos >= 0] = self.first[pos[pos >= 0]]
+        return out
+
+    def update(self, newer: "FirstSeenIndex") -> "FirstSeenIndex":
+        """Fold in the index of later messages: earlier timestamps win, new users are inserted."""
+        pos = self._find(newer.keys)
+        known = pos >= 0
+        self.first[pos[known]] = np.minimum(self.first[pos[known]], newer.first[known])
+        fresh = ~known
+        at = np.searchsorted(self.keys, newer.keys[fresh])
+        self.keys = np.insert(self.keys, at, newer.keys[fresh])
+        self.first = np.insert(self.first, at, newer.first[fresh])
+        return self
+
+    def new_per_month(self) -> pd.Series:
+        """Number of users whose first message falls in each month (month id -> count)."""
+        return pd.Series(month_index(self.first)).value_counts().sort_index()
@@ -1,36 +1,259 @@
+import gzip
+import io
 import json
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, TextIO
 
+try:
+    import zstandard  # type: ignore
+except ImportError:  # optional: only needed for .zst exports
+    zstandard = None
 
-def find_input_file(base: Path, stem: str) -> Optional[Path]:
-    p = base / f"{stem}"
+_DECODER = json.JSONDecoder()
+_WS = " \t\n\r"
+
+# Size of a single read from the export file (characters).
+CHUNK_SIZE = 1 << 20
+
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+# files picked up from a directory given as a chat's `file`
+_EXPORT_SUFFIXES = (".json", ".jsonl", ".ndjson")
+
+
+def base_suffix(path: Path) -> str:
+    """Format suffix without the compression one: a.json.gz -> .json."""
+    suffixes = [x.lower() for x in path.suffixes]
+    if suffixes and suffixes[-1] in COMPRESSED_SUFFIXES:
+        suffixes.pop()
+    return suffixes[-1] if suffixes else ""
+
+
+def is_compressed(path: Path) -> bool:
+    return path.suffix.lower() in COMPRESSED_SUFFIXES
+
+
+def open_binary(path: Path) -> BinaryIO:
+    """Open an export for reading, decompressing .gz/.zst on the fly."""
+    suffix = path.suffix.lower()
+    if suffix == ".gz":
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+    if suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"reading {path.name} needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+    return path.open("rb")
+
+
+def find_input_files(base: Path, spec: str) -> List[Path]:
+    """
+    Export files of a chat: `spec` is a file (also found with a .gz/.zst
+    suffix added), a directory of shards or a glob pattern, relative to
+    `base`. Shards are returned sorted by name; [] when nothing matches.
+    """
+    p = base / spec
+    if any(ch in spec for ch in "*?["):
+        return sorted(f for f in base.glob(spec) if f.is_file())
+    if p.is_dir():
+        return sorted(f for f in p.iterdir()
+                      if f.is_file() and not f.name.startswith(".") and base_suffix(f) in _EXPORT_SUFFIXES)
     if p.exists():
-        return p
+        return [p]
+    for suffix in COMPRESSED_SUFFIXES:
+        c = p.with_name(p.name + suffix)
+        if c.exists():
+            return [c]
+    return []
 
-    return None
 
+def find_input_file(base: Path, stem: str) -> Optional[Path]:
+    files = find_input_files(base, stem)
+    return files[0] if len(files) == 1 else None
 
-def load_messages(path: Path) -> List[Dict[str, Any]]:
-    msgs: List[Dict[str, Any]] = []
-
-    if path.suffix.lower() == ".json":
-        data = json.loads(path.read_text(encoding="utf-8"))
-        if isinstance(data, dict) and isinstance(data.get("messages"), list):
-            return data["messages"]
-        if isinstance(data, list):
-            return data
-        return []
-
-    # jsonl/ndjson
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
+
+class _JsonReader:
+    """
+    Minimal pull reader over a JSON text stream.
+
+    Keeps only the unparsed tail of the file in memory, so a single value
+    (one message) is decoded at a time with json.JSONDecoder.raw_decode.
+    Also tracks the byte offset just past the last array item, so that a
+    later run can resume reading after it.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE, start: int = 0):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.consumed = start   # bytes before buf[0]
+        self.mark = -1          # buf position after the last array item ...
+        self.mark_bytes = start  # ... or its byte offset once dropped from buf
+
+    @property
+    def item_end(self) -> int:
+        """Byte offset right after the last array item read so far."""
+        if self.mark >= 0:
+            return self.consumed + len(self.buf[:self.mark].encode("utf-8"))
+        return self.mark_bytes
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer; grow reads for huge values."""
+        if self.eof:
+            return False
+        self.mark_bytes = self.item_end
+        self.mark = -1
+        self.consumed += len(self.buf[:self.pos].encode("utf-8"))
+        tail = self.buf[self.pos:]
+        chunk = self.f.read(max(self.chunk_size, len(tail)))
+        if not chunk:
+            self.eof = True
+        self.buf = tail + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """Return the next non-whitespace char without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"expected {ch!r} in JSON stream, got {got or 'EOF'!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
             try:
-                msgs.append(json.loads(line))
-            except Exception:
-                pass
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+                # a number at the very end of the buffer may be cut in half
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_array(self) -> Iterator[Any]:
+        """Yield items of the array starting at the current position."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        yield from self.iter_items()
+
+    def iter_items(self) -> Iterator[Any]:
+        """Yield the remaining array items; positioned before an item."""
+        while True:
+            yield self.value()
+            self.mark = self.pos
+            ch = self.peek()
+            self.pos += 1
+            if ch == "]":
+                return
+            if ch != ",":
+                raise ValueError(f"expected ',' or ']' in JSON array, got {ch or 'EOF'!r}")
+
+
+def _iter_json_messages(r: _JsonReader) -> Iterator[Dict[str, Any]]:
+    """Stream items of top-level `messages` (or of a top-level array)."""
+    first = r.peek()
+    if first == "[":
+        yield from r.iter_array()
+        return
+    if first != "{":
+        return
+
+    r.expect("{")
+    if r.peek() == "}":
+        return
+    while True:
+        key = r.value()
+        r.expect(":")
+        if key == "messages" and r.peek() == "[":
+            yield from r.iter_array()
+            return
+        r.value()  # skip other top-level fields (name, type, id, ...)
+        if r.peek() != ",":
+            return
+        r.pos += 1
+
+
+def _iter_json_tail(r: _JsonReader) -> Iterator[Dict[str, Any]]:
+    """Stream the messages that follow an item end recorded earlier."""
+    ch = r.peek()
+    if ch == "]":
+        return
+    if ch != ",":
+        raise ValueError(f"cannot resume JSON array: got {ch or 'EOF'!r}")
+    r.pos += 1
+    yield from r.iter_items()
+
+
+class MessageStream:
+    """
+    Re-iterable view of an export: every iteration streams the file again.
 
-    return msgs
+    `.json` files are parsed incrementally (Telegram export object or a plain
+    array); anything else is read as jsonl/ndjson, skipping broken lines.
+    `.gz`/`.zst` files are decompressed while streaming.
+    With `resume_from` (a previous `end_offset`) only the messages after it
+    are read. After a complete pass over an uncompressed `.json` file,
+    `end_offset` is the byte offset right after the last message.
+    """
+
+    def __init__(self, path: Path, resume_from: Optional[int] = None):
+        self.path = path
+        self.resume_from = resume_from
+        self.end_offset: Optional[int] = None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        self.end_offset = None
+        compressed = is_compressed(self.path)
+        if self.resume_from is not None and (compressed or base_suffix(self.path) != ".json"):
+            raise ValueError(f"resuming is only supported for uncompressed .json exports: {self.path}")
+
+        if base_suffix(self.path) == ".json":
+            with open_binary(self.path) as raw:
+                start = self.resume_from or 0
+                if start:
+                    raw.seek(start)
+                r = _JsonReader(io.TextIOWrapper(raw, encoding="utf-8", newline=""), start=start)
+                if self.resume_from is None:
+                    yield from _iter_json_messages(r)
+                else:
+                    yield from _iter_json_tail(r)
+                # offsets into decompressed data cannot be checked against the file
+                if not compressed:
+                    self.end_offset = r.item_end
+            return
+
+        # jsonl/ndjson
+        with io.TextIOWrapper(open_binary(self.path), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except Exception:
+                    pass
+
+
+def iter_messages(path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield messages one by one with bounded memory."""
+    return iter(MessageStream(path))
+
+
+def load_messages(path: Path) -> List[Dict[str, Any]]:
+    """Load all messages into a list (prefer iter_messages/MessageStream for big exports)."""
+    return list(iter_messages(path))
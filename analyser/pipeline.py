@@ -0,0 +1,94 @@
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import AbstractSet, Any, Callable, Deque, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from .io_loader import MessageStream
+from .table import MessageTable, build_message_table, concat_tables
+
+T = TypeVar("T")
+
+
+def load_table(path: Union[Path, Sequence[Path]], resume_from: Optional[int] = None,
+               columns: Optional[AbstractSet[str]] = None, workers: int = 1) -> MessageTable:
+    """
+    Stream an export (or only its messages after `resume_from`) into a
+    MessageTable, keeping only `columns` (None: all of them).
+
+    An export split into several files is given as their list: up to
+    `workers` processes decode the shards at once and their tables are
+    merged in message id order.
+    """
+    if not isinstance(path, Path):
+        shards = list(path)
+        if len(shards) != 1:
+            if resume_from is not None:
+                raise ValueError("resuming is only supported for single-file exports")
+            return concat_tables(_load_shards(shards, columns, workers))
+        path = shards[0]
+    stream = MessageStream(path, resume_from=resume_from)
+    table = build_message_table(stream, columns)
+    if stream.end_offset is not None:
+        table.end_offset = stream.end_offset
+    return table
+
+
+def _load_shards(shards: List[Path], columns: Optional[AbstractSet[str]], workers: int) -> List[MessageTable]:
+    """Tables of `shards`, in order; decoded in parallel (JSON decoding holds the GIL)."""
+    workers = min(workers, len(shards))
+    if workers <= 1:
+        return [load_table(p, columns=columns) for p in shards]
+    ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(partial(load_table, columns=columns), shards))
+
+
+def prefetch(
+        jobs: List[Tuple[T, Callable[[], Any]]],
+        in_flight: int = 1,
+        finish: Optional[Callable[[Any], MessageTable]] = None,
+) -> Iterator[Tuple[T, MessageTable]]:
+    """
+    Yield (job, table) in order while the next exports load in the background.
+
+    Every job comes with a picklable zero-argument loader (e.g. a partial of
+    load_table). Loaders run in the background; when `finish` is given it
+    turns their result into the table in this process (e.g. a cache entry
+    that is cheaper to memory-map here than to send over a pipe).
+
+    At most `in_flight` tables exist at once: the one being processed plus
+    up to in_flight - 1 loading/loaded ahead in separate processes (JSON
+    decoding holds the GIL, so threads would not overlap it). The caller
+    should drop its reference to a table before asking for the next one.
+    """
+    if in_flight <= 1 or len(jobs) <= 1:
+        for job, load in jobs:
+            table = load()
+            if finish is not None:
+                table = finish(table)
+            yield job, table
+            del table
+        return
+
+    # spawn: loader processes must not inherit tables of earlier chats
+    with ProcessPoolExecutor(max_workers=in_flight - 1, mp_context=mp.get_context("spawn")) as pool:
+        pending: Deque[Tuple[T, Future]] = deque()
+        queue = iter(jobs)
+        for job, load in queue:
+            pending.append((job, pool.submit(load)))
+            if len(pending) >= in_flight - 1:
+                break
+
+        while pending:
+            job, fut = pending.popleft()
+            table = fut.result()
+            del fut
+            if finish is not None:
+                table = finish(table)
+            nxt = next(queue, None)
+            if nxt is not None:
+                pending.append((nxt[0], pool.submit(nxt[1])))
+            yield job, table
+            del table
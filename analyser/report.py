@@ -0,0 +1,140 @@
+import json
+import os
+import resource
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def _status_kb(key: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> int:
+    """
+    Start a peak-memory measurement; returns the current RSS in KiB.
+
+    On Linux the kernel's high-water mark is reset, so peak_rss_kb() is
+    the peak since this call. Elsewhere it stays the peak of the process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        pass
+    rss = _status_kb("VmRSS")
+    return rss if rss is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss_kb() -> int:
+    hwm = _status_kb("VmHWM")
+    return hwm if hwm is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@dataclass
+class ProcessorRun:
+    """Measurements of one processor on one chat."""
+    processor: str
+    status: str                 # "ok", "cached" or "error"
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_mb: float = 0.0        # peak RSS above the RSS at start
+    messages: int = 0           # rows it consumed (only its window, if any)
+    artifacts: Dict[str, int] = field(default_factory=dict)  # file name -> bytes
+    error: Optional[str] = None
+
+
+@dataclass
+class ChatRun:
+    chat: str
+    name: str
+    messages: int
+    resumed: bool
+    wait_s: float               # waiting for the table (load not hidden by prefetch)
+    aggregate_s: float
+    corpus_s: float = 0.0       # tokenizing texts up front (0 when left to the processors)
+    processors: List[ProcessorRun] = field(default_factory=list)
+
+
+def _label(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+# metric name, help, ProcessorRun -> value
+_PROCESSOR_METRICS = (
+    ("processor_wall_seconds", "Wall time of a processor on a chat.", lambda r: r.wall_s),
+    ("processor_cpu_seconds", "CPU time of a processor on a chat.", lambda r: r.cpu_s),
+    ("processor_peak_bytes", "Peak RSS growth while a processor ran.", lambda r: r.peak_mb * 2 ** 20),
+    ("processor_messages", "Messages a processor consumed.", lambda r: r.messages),
+    ("processor_artifact_bytes", "Total size of the files a processor produced.",
+     lambda r: sum(r.artifacts.values())),
+    ("processor_cached", "1 if the charts were restored from the result cache.",
+     lambda r: int(r.status == "cached")),
+    ("processor_failed", "1 if the processor raised.", lambda r: int(r.status == "error")),
+)
+
+
+class RunReport:
+    """Per-chat, per-processor measurements of one run of main.py."""
+
+    PREFIX = "tg_analyser_"
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.chats: List[ChatRun] = []
+
+    def add(self, chat: ChatRun) -> None:
+        self.chats.append(chat)
+
+    def as_dict(self) -> dict:
+        return {
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec="seconds"),
+            "duration_s": time.time() - self.started,
+            "chats": [asdict(c) for c in self.chats],
+        }
+
+    def write_json(self, path: Path) -> None:
+        _write_atomic(path, json.dumps(self.as_dict(), ensure_ascii=False, indent=2))
+
+    def to_prometheus(self) -> str:
+        """Text exposition format, for node_exporter's textfile collector."""
+        p = self.PREFIX
+        lines = [
+            f"# HELP {p}run_start_timestamp_seconds Start of the last run.",
+            f"# TYPE {p}run_start_timestamp_seconds gauge",
+            f"{p}run_start_timestamp_seconds {self.started:.3f}",
+            f"# HELP {p}run_duration_seconds Wall time of the last run.",
+            f"# TYPE {p}run_duration_seconds gauge",
+            f"{p}run_duration_seconds {time.time() - self.started:.3f}",
+            f"# HELP {p}chat_messages Messages loaded for a chat (only new ones when resumed).",
+            f"# TYPE {p}chat_messages gauge",
+        ]
+        for c in self.chats:
+            lines.append(f'{p}chat_messages{{chat="{_label(c.chat)}"}} {c.messages}')
+        for name, help_text, value in _PROCESSOR_METRICS:
+            lines += [f"# HELP {p}{name} {help_text}", f"# TYPE {p}{name} gauge"]
+            for c in self.chats:
+                for r in c.processors:
+                    labels = f'chat="{_label(c.chat)}",processor="{_label(r.processor)}"'
+                    lines.append(f"{p}{name}{{{labels}}} {value(r):g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path) -> None:
+        _write_atomic(path, self.to_prometheus())
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    # the textfile collector must never see a partially written file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
@@ -0,0 +1,228 @@
+import cProfile
+import io
+import multiprocessing as mp
+import os
+import pstats
+import shutil
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from processors.registry import REGISTRY
+
+from .cache import ResultCache
+from .report import ProcessorRun, peak_rss_kb, reset_peak_rss
+from .table import MessageTable
+
+# Data of the chat being processed; forked workers inherit it instead of
+# receiving a pickled copy per task.
+_SHARED: Dict[str, Any] = {}
+
+# Context entries that are run-time plumbing, not processor settings;
+# they are left out of result cache keys.
+RUNTIME_KEYS = frozenset({"aggregates", "state_store", "resumed", "runner_workers"})
+
+
+def run_processor(name: str, table: MessageTable, out_dir: Path, context: Dict[str, Any]) -> None:
+    """
+    Instantiate and run a processor by its registry id.
+
+    With a `window` (start, stop) in the context it runs on the rows of
+    that date range; counters aggregated over the whole chat are dropped.
+    """
+    cls = REGISTRY.get(name)
+    if not cls:
+        print(f"[warn] unknown processor: {name} (skip)")
+        return
+    window = context.get("window")
+    if window is not None:
+        table = table.window(*window)
+        context = {**context, "aggregates": None}
+    try:
+        inst = cls(output_dir=out_dir, **context)
+    except TypeError:
+        inst = cls(output_dir=out_dir)
+    try:
+        inst.run(table, **context)
+    except TypeError:
+        inst.run(table)
+
+
+def resolve_workers(workers: int) -> int:
+    """Number of pool processes; 0 or less means one per CPU."""
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def _result_key(results: ResultCache, name: str, context: Dict[str, Any]) -> str:
+    cls = REGISTRY.get(name)
+    kwargs = {k: v for k, v in context.items() if k not in RUNTIME_KEYS}
+    anon = context.get("channel_type") == "anonymous"
+    return results.key(name, getattr(cls, "version", 0), kwargs, anon)
+
+
+class _StagedPaths(io.TextIOBase):
+    """stdout of a processor with its staging directory shown as the output directory."""
+
+    def __init__(self, stage: Path, out_dir: Path):
+        self.stage, self.out_dir = str(stage), str(out_dir)
+        self.stream = sys.stdout
+
+    def write(self, s: str) -> int:
+        self.stream.write(s.replace(self.stage, self.out_dir))
+        return len(s)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def _profile(name: str, table: MessageTable, out_dir: Path, context: Dict[str, Any], dump_dir: Path) -> None:
+    """run_processor under cProfile; stats go to <dump_dir>/<name>.prof and a cumulative-time .txt."""
+    prof = cProfile.Profile()
+    try:
+        prof.runcall(run_processor, name, table, out_dir, context)
+    finally:
+        dump_dir.mkdir(parents=True, exist_ok=True)
+        prof.dump_stats(dump_dir / f"{name}.prof")
+        with (dump_dir / f"{name}.txt").open("w", encoding="utf-8") as f:
+            pstats.Stats(prof, stream=f).sort_stats("cumulative").print_stats(60)
+
+
+def run_cached(
+        name: str,
+        table: MessageTable,
+        out_dir: Path,
+        context: Dict[str, Any],
+        results: Optional[ResultCache] = None,
+        profile_dir: Optional[Path] = None,
+) -> Tuple[bool, List[str]]:
+    """
+    Run a processor unless its charts are in the result cache.
+
+    The processor writes into a private staging directory; its files are
+    then moved into `out_dir` one by one with os.replace, so an interrupted
+    run never leaves a half-written chart behind. With `profile_dir` it
+    always runs, under cProfile. Returns (restored from cache, file names).
+    """
+    key = _result_key(results, name, context) if results and name in REGISTRY else None
+    if key and profile_dir is None:
+        files = results.restore(key, out_dir)
+        if files is not None:
+            print(f"[cached] {name}")
+            return True, files
+
+    stage = out_dir / f".{name}.{uuid.uuid4().hex}.tmp"
+    stage.mkdir(parents=True)
+    try:
+        # processors log where they save; point that at the final location
+        with redirect_stdout(_StagedPaths(stage, out_dir)):
+            if profile_dir is not None:
+                _profile(name, table, stage, context, profile_dir)
+            else:
+                run_processor(name, table, stage, context)
+        if key:
+            results.store(key, stage)
+        files = []
+        for p in stage.iterdir():
+            os.replace(p, out_dir / p.name)
+            files.append(p.name)
+    finally:
+        shutil.rmtree(stage, ignore_errors=True)
+    return False, sorted(files)
+
+
+def _run_safe(
+        name: str,
+        table: MessageTable,
+        out_dir: Path,
+        context: Dict[str, Any],
+        results: Optional[ResultCache] = None,
+        profile_dir: Optional[Path] = None,
+) -> ProcessorRun:
+    """Run and measure a processor; a failure is recorded instead of raised."""
+    # rows the processor consumes: only its window, if it has one
+    window = context.get("window")
+    messages = table.window_size(*window) if window is not None else len(table)
+    run = ProcessorRun(processor=name, status="ok", messages=messages)
+    base = reset_peak_rss()
+    t0, c0 = time.perf_counter(), time.process_time()
+    try:
+        cached, files = run_cached(name, table, out_dir, context, results, profile_dir)
+        run.status = "cached" if cached else "ok"
+        run.artifacts = {f: (out_dir / f).stat().st_size for f in files}
+    except Exception:
+        run.status, run.error = "error", traceback.format_exc()
+    run.wall_s = time.perf_counter() - t0
+    run.cpu_s = time.process_time() - c0
+    run.peak_mb = max(0, peak_rss_kb() - base) / 1024
+    return run
+
+
+def _run_shared(name: str) -> ProcessorRun:
+    """Pool task: run one processor on the chat inherited from the parent."""
+    return _run_safe(name, _SHARED["table"], _SHARED["out_dir"], _SHARED["contexts"][name],
+                     _SHARED["results"], _SHARED["profile"].get(name))
+
+
+def _run_pool(names: List[str], workers: int) -> Dict[str, ProcessorRun]:
+    runs: Dict[str, ProcessorRun] = {}
+    ctx = mp.get_context("fork")
+    with ProcessPoolExecutor(max_workers=min(workers, len(names)), mp_context=ctx) as pool:
+        futures = {pool.submit(_run_shared, name): name for name in names}
+        for fut in as_completed(futures):
+            name = futures[fut]
+            try:
+                runs[name] = fut.result()
+            except BrokenProcessPool as e:
+                runs[name] = ProcessorRun(processor=name, status="error", error=f"worker process died: {e}")
+    return runs
+
+
+def run_processors(
+        names: List[str],
+        table: MessageTable,
+        out_dir: Path,
+        context: Dict[str, Any],
+        workers: int = 1,
+        results: Optional[ResultCache] = None,
+        profile: Optional[Dict[str, Path]] = None,
+        params: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, ProcessorRun]:
+    """
+    Run processors for one chat, sequentially or in a process pool.
+
+    The pool is forked after the table is published in _SHARED, so workers
+    read the parent's memory copy-on-write. A failing processor is reported
+    and does not stop the others.
+
+    With `results`, processors whose charts are cached for the same export
+    and settings are not run; their saved files are restored instead.
+    `profile` maps processor ids to run under cProfile to the directory
+    their stats are dumped to. `params` are per-processor settings added
+    to the shared context, along with `runner_workers`, the number of
+    processors running at once. Returns {processor id: measurements}.
+    """
+    profile = profile or {}
+    params = params or {}
+    workers = resolve_workers(workers)
+    pooled = workers > 1 and len(names) > 1 and "fork" in mp.get_all_start_methods()
+    running = min(workers, len(names)) if pooled else 1
+    contexts = {name: {**context, **params.get(name, {}), "runner_workers": running} for name in names}
+    if pooled:
+        _SHARED.update(table=table, out_dir=out_dir, contexts=contexts, results=results, profile=profile)
+        try:
+            runs = _run_pool(names, workers)
+        finally:
+            _SHARED.clear()
+    else:
+        runs = {name: _run_safe(name, table, out_dir, contexts[name], results, profile.get(name)) for name in names}
+
+    for name in names:
+        if runs[name].error:
+            print(f"[error] {name} failed:\n{runs[name].error.rstrip()}")
+    return {name: runs[name] for name in names}
@@ -0,0 +1,286 @@
+import hashlib
+import heapq
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Hashable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class SpaceSaving:
+    """
+    Top-k counter in bounded memory (Metwally et al.'s Space-Saving).
+
+    At most `capacity` keys are monitored. A new key evicts the one with
+    the smallest count and inherits that count as its error, so for every
+    monitored key count - error <= true count <= count, and every key more
+    frequent than n / capacity is monitored. Two summaries merge into one
+    with the same guarantees (Agarwal et al., "Mergeable summaries").
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.n = 0                            # total weight seen
+        self.counts: Dict[Hashable, int] = {}
+        self.errors: Dict[Hashable, int] = {}
+        self._heap: List[Tuple[int, Hashable]] = []  # (count, key), stale entries skipped lazily
+
+    def __getstate__(self) -> dict:
+        return {"capacity": self.capacity, "n": self.n, "counts": self.counts, "errors": self.errors}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._heap = [(c, k) for k, c in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[Hashable, int]:
+        while True:
+            c, key = heapq.heappop(self._heap)
+            current = self.counts.get(key)
+            if current == c:
+                return key, c
+            if current is not None:
+                heapq.heappush(self._heap, (current, key))
+
+    def min_count(self) -> int:
+        """Largest possible count of an unmonitored key."""
+        if len(self.counts) < self.capacity:
+            return 0
+        key, c = self._pop_min()
+        heapq.heappush(self._heap, (c, key))
+        return c
+
+    def update(self, counts: Mapping[Hashable, int]) -> None:
+        """Add weighted occurrences, e.g. the exact counts of one chunk."""
+        for key, w in counts.items():
+            self.n += w
+            c = self.counts.get(key)
+            if c is not None:
+                self.counts[key] = c + w
+                continue
+            err = 0
+            if len(self.counts) >= self.capacity:
+                old, err = self._pop_min()
+                del self.counts[old], self.errors[old]
+            self.counts[key] = err + w
+            self.errors[key] = err
+            heapq.heappush(self._heap, (err + w, key))
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        # a key missing from a full summary may have had up to its min count
+        m1, m2 = self.min_count(), other.min_count()
+        merged = {k: (self.counts.get(k, m1) + other.counts.get(k, m2),
+                      self.errors.get(k, m1) + other.errors.get(k, m2))
+                  for k in self.counts.keys() | other.counts.keys()}
+        keep = sorted(merged.items(), key=lambda kv: (-kv[1][0], str(kv[0])))[:self.capacity]
+        self.n += other.n
+        self.counts = {k: c for k, (c, _) in keep}
+        self.errors = {k: e for k, (_, e) in keep}
+        self.__setstate__(self.__getstate__())
+        return self
+
+    def top(self, n: int) -> List[Tuple[Hashable, int, int]]:
+        """(key, upper bound, lower bound) of the `n` largest counts."""
+        items = sorted(self.counts.items(), key=lambda kv: (-kv[1], str(kv[0])))[:n]
+        return [(k, c, c - self.errors[k]) for k, c in items]
+
+
+class CountMin:
+    """
+    Count-Min sketch: estimate(key) >= true count, and exceeds it by more
+    than eps * n with probability at most delta.
+    """
+
+    def __init__(self, eps: float = 1e-4, delta: float = 0.01):
+        self.width = max(1, math.ceil(math.e / eps))
+        self.depth = max(1, math.ceil(math.log(1 / delta)))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+
+    def _cols(self, keys: List[Hashable]) -> np.ndarray:
+        """depth x len(keys) column of every key in every row."""
+        digests = b"".join(hashlib.blake2b(str(k).encode("utf-8"), digest_size=4 * self.depth).digest()
+                           for k in keys)
+        return (np.frombuffer(digests, dtype="<u4").reshape(len(keys), self.depth).T % self.width).astype(np.int64)
+
+    def update(self, counts: Mapping[Hashable, int]) -> None:
+        if not counts:
+            return
+        cols = self._cols(list(counts))
+        w = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+        for row in range(self.depth):
+            np.add.at(self.table[row], cols[row], w)
+
+    def estimate(self, keys: List[Hashable]) -> np.ndarray:
+        if not keys:
+            return np.zeros(0, dtype=np.int64)
+        cols = self._cols(keys)
+        return self.table[np.arange(self.depth)[:, None], cols].min(axis=0)
+
+    def merge(self, other: "CountMin") -> "CountMin":
+        if self.table.shape != other.table.shape:
+            raise ValueError("CountMin: cannot merge sketches of different size")
+        self.table += other.table
+        return self
+
+
+@dataclass
+class HeavyHitters:
+    """
+    Space-Saving candidates, their counts tightened by a Count-Min sketch:
+    both only over-estimate, so the smaller of the two is still an upper
+    bound. `bound` is the guaranteed maximum over-estimate, n / capacity.
+    """
+    capacity: int = 1000
+    eps: float = 1e-4
+    delta: float = 0.01
+    summary: SpaceSaving = field(init=False)
+    cms: CountMin = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.summary = SpaceSaving(self.capacity)
+        self.cms = CountMin(self.eps, self.delta)
+
+    @property
+    def n(self) -> int:
+        return self.summary.n
+
+    @property
+    def bound(self) -> int:
+        return self.summary.n // self.summary.capacity
+
+    def update(self, counts: Mapping[Hashable, int]) -> None:
+        self.summary.update(counts)
+        self.cms.update(counts)
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        self.summary.merge(other.summary)
+        self.cms.merge(other.cms)
+        return self
+
+    def top(self, n: int) -> List[Tuple[Hashable, int, int]]:
+        """(key, estimate, lower bound) of the `n` heaviest keys, heaviest first."""
+        cand = self.summary.top(self.summary.capacity)
+        est = self.cms.estimate([k for k, _, _ in cand])
+        rows = [(k, min(hi, int(e)), lo) for (k, hi, lo), e in zip(cand, est)]
+        rows.sort(key=lambda r: (-r[1], str(r[0])))
+        return rows[:n]
+
+
+def chunk_counts(codes: np.ndarray, labels: np.ndarray, chunk: int = 1 << 20) -> Iterator[Dict[str, int]]:
+    """Exact label -> count of every `chunk` consecutive categorical codes (-1 skipped)."""
+    for start in range(0, len(codes), chunk):
+        part = codes[start:start + chunk]
+        uniq, n = np.unique(part[part >= 0], return_counts=True)
+        yield dict(zip(labels[uniq].tolist(), n.tolist()))
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Bit length of every uint64 (0 for 0), exact: floats hold 32-bit halves exactly."""
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    bl_hi = np.frexp(hi)[1]
+    return np.where(hi > 0, 32 + bl_hi, np.frexp(lo)[1]).astype(np.int64)
+
+
+def hash64(keys: Sequence[Hashable]) -> np.ndarray:
+    """Stable 64-bit hashes of keys, the same in every process and run."""
+    return np.frombuffer(b"".join(hashlib.blake2b(str(k).encode("utf-8"), digest_size=8).digest()
+                                  for k in keys), dtype="<u8")
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch (Flajolet et al.) with 2**precision one-byte
+    registers; relative standard error ~ 1.04 / sqrt(2**precision), e.g.
+    0.8% at precision 14 (16 KiB). The union of two sketches is their
+    register-wise maximum, so sketches of months, chats or runs combine
+    without the original keys.
+    """
+
+    def __init__(self, precision: int = 14, registers: Optional[np.ndarray] = None):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog: precision must be 4..18, got {precision}")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    @staticmethod
+    def positions(hashes: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Register index and rank (leading zeros + 1 of the remaining bits) of each hash."""
+        rest_bits = 64 - precision
+        idx = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        rank = (rest_bits - _bit_length(rest) + 1).astype(np.uint8)
+        return idx, rank
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        idx, rank = self.positions(hashes, self.precision)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog: cannot merge sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        est = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        zeros = int((self.registers == 0).sum())
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return float(est)
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], np.frombuffer(data, dtype=np.uint8, offset=1).copy())
+
+
+def save_hll(path: Path, sketches: Mapping[int, HyperLogLog]) -> None:
+    """Write {bucket: sketch} (e.g. month index -> sketch) as one .npz file."""
+    keys = sorted(sketches)
+    precision = {sketches[k].precision for k in keys}
+    if len(precision) > 1:
+        raise ValueError("save_hll: sketches of different precision")
+    regs = np.stack([sketches[k].registers for k in keys]) if keys else np.zeros((0, 0), dtype=np.uint8)
+    with path.open("wb") as f:
+        np.savez_compressed(f, keys=np.asarray(keys, dtype=np.int64), registers=regs,
+                            precision=np.int64(precision.pop() if precision else 0))
+
+
+def load_hll(path: Path) -> Dict[int, HyperLogLog]:
+    with np.load(path) as z:
+        p = int(z["precision"])
+        return {int(k): HyperLogLog(p, r.copy()) for k, r in zip(z["keys"], z["registers"])}
+
+
+def main() -> None:
+    """Union of saved month sketches, e.g. active users of several chats per year."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("files", nargs="+", type=Path, help=".hll.npz files written by active_users_per_month")
+    parser.add_argument("--period", choices=("month", "quarter", "year", "all"), default="month")
+    args = parser.parse_args()
+
+    step = {"month": 1, "quarter": 3, "year": 12}.get(args.period)
+    total: Dict[int, HyperLogLog] = {}
+    for path in args.files:
+        for m, sketch in load_hll(path).items():
+            b = 0 if step is None else m // step * step
+            if b in total:
+                total[b].merge(sketch)
+            else:
+                total[b] = sketch
+    for b in sorted(total):
+        month = str(np.datetime64(b, "M"))
+        label = {"month": month, "quarter": f"{month[:4]}-Q{b % 12 // 3 + 1}", "year": month[:4]}.get(args.period, "all")
+        print(f"{label}\t{round(total[b].count())}")
+
+
+if __name__ == "__main__":
+    main()
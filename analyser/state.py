@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import pickle
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# bytes hashed at the start of the export and before the watermark offset
+_CHECK_WINDOW = 1 << 16
+
+
+def prefix_check(path: Path, offset: int) -> str:
+    """
+    Cheap fingerprint of the already processed part of an export.
+
+    Hashes the head of the file and the window right before `offset`:
+    enough to notice a different or rewritten export without reading
+    gigabytes; edits deep inside old messages are not detected.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        h.update(f.read(min(_CHECK_WINDOW, offset)))
+        start = max(0, offset - _CHECK_WINDOW)
+        f.seek(start)
+        h.update(f.read(offset - start))
+    return h.hexdigest()
+
+
+def settings_digest(version: int, params: Dict[str, Any]) -> str:
+    """What a saved state depends on besides the messages: processor version and settings."""
+    blob = json.dumps({"version": version, "params": params}, sort_keys=True, default=repr)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=8).hexdigest()
+
+
+@dataclass
+class Watermark:
+    """What the saved states of a chat cover."""
+    max_id: int                 # highest message id folded into the states
+    offset: int                 # byte offset past that message in the export
+    check: str                  # prefix_check(export, offset)
+    states: Dict[str, str] = field(default_factory=dict)  # processor id -> state file
+    settings: Dict[str, str] = field(default_factory=dict)  # processor id -> settings_digest
+
+
+class StateStore:
+    """
+    Saved per-processor aggregates of one chat plus their watermark.
+
+    States of a run are written to new files and become visible only when
+    commit() atomically replaces watermark.json, so an interrupted run never
+    leaves half-merged states behind.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.token = uuid.uuid4().hex[:12]
+
+    @property
+    def _watermark_path(self) -> Path:
+        return self.root / "watermark.json"
+
+    def watermark(self) -> Optional[Watermark]:
+        try:
+            return Watermark(**json.loads(self._watermark_path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def resumable(self, path: Path, settings: Dict[str, str]) -> Optional[Watermark]:
+        """
+        Watermark to resume from, if every processor in `settings` (id ->
+        settings_digest) has a state saved with the same settings and the
+        export only grew since.
+        """
+        wm = self.watermark()
+        if wm is None or wm.offset <= 0 or path.suffix.lower() != ".json":
+            return None
+        if any(pid not in wm.states or wm.settings.get(pid) != s for pid, s in settings.items()):
+            return None
+        try:
+            if path.stat().st_size <= wm.offset or prefix_check(path, wm.offset) != wm.check:
+                return None
+        except OSError:
+            return None
+        return wm
+
+    def state_file(self, processor_id: str) -> str:
+        """File name the state of `processor_id` gets in this run."""
+        return f"{processor_id}.{self.token}.pkl"
+
+    def saved(self, processor_id: str) -> bool:
+        """Whether this run has saved a state for `processor_id`."""
+        return (self.root / self.state_file(processor_id)).exists()
+
+    def load(self, processor_id: str) -> Any:
+        wm = self.watermark()
+        if wm is None or processor_id not in wm.states:
+            raise KeyError(f"no saved state for {processor_id}")
+        with (self.root / wm.states[processor_id]).open("rb") as f:
+            return pickle.load(f)
+
+    def save(self, processor_id: str, state: Any) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        dst = self.root / self.state_file(processor_id)
+        tmp = dst.with_suffix(".tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, dst)
+
+    def commit(self, wm: Watermark) -> None:
+        """Publish the watermark and delete state files it no longer references."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self._watermark_path.with_suffix(f".{self.token}.tmp")
+        tmp.write_text(json.dumps(asdict(wm)), encoding="utf-8")
+        os.replace(tmp, self._watermark_path)
+
+        keep = set(wm.states.values())
+        for p in self.root.glob("*.pkl"):
+            if p.name not in keep:
+                p.unlink(missing_ok=True)
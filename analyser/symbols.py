@@ -0,0 +1,115 @@
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+class SymbolTable:
+    """
+    Labels (user ids, names, handles, ...) interned into dense int32 codes
+    for the whole run: every chat processed by this process shares it, so
+    each label is stored once however many chats and states mention it.
+    """
+
+    def __init__(self) -> None:
+        self.index: Dict[str, int] = {}
+        self.labels: List[str] = []
+        self._array: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def intern(self, labels: Iterable[str]) -> np.ndarray:
+        """Codes of `labels`, adding the unseen ones."""
+        out = array("i")
+        for s in labels:
+            code = self.index.get(s)
+            if code is None:
+                code = self.index[s] = len(self.labels)
+                self.labels.append(s)
+                self._array = None
+            out.append(code)
+        return np.frombuffer(out, dtype=np.int32)
+
+    def lookup(self, label: str) -> int:
+        """Code of `label`, -1 if it was never interned."""
+        return self.index.get(label, -1)
+
+    def label(self, codes: np.ndarray) -> np.ndarray:
+        """Labels of `codes` (object array)."""
+        if self._array is None or len(self._array) != len(self.labels):
+            self._array = np.asarray(self.labels, dtype=object)
+        return self._array[codes]
+
+    def mapping(self, cat: pd.Categorical) -> np.ndarray:
+        """Run codes of the categories of `cat`, indexable by its codes."""
+        return self.intern(str(c) for c in cat.categories)
+
+
+# shared by every chat processed in this process
+SYMBOLS = SymbolTable()
+
+Column = Union[pd.Categorical, np.ndarray]
+
+
+@dataclass
+class CodeCounts:
+    """
+    Occurrences of distinct key tuples, e.g. messages per user or
+    (month, user) pairs. Columns built from categoricals hold SYMBOLS codes;
+    a pickled CodeCounts stores their labels instead, so saved states stay
+    valid in later runs whose codes differ.
+    """
+    keys: np.ndarray                # int64, (n, k): one column per key part
+    counts: np.ndarray              # int64, (n,)
+    symbolic: Tuple[bool, ...]      # which columns are SYMBOLS codes
+
+    @classmethod
+    def of(cls, *columns: Column, mask: Optional[np.ndarray] = None) -> "CodeCounts":
+        """Count the rows of `mask` (boolean or row indices) by `columns`; rows missing a categorical value are skipped."""
+        symbolic = tuple(isinstance(c, pd.Categorical) for c in columns)
+        cols = [np.asarray(c.codes if s else c).astype(np.int64) for c, s in zip(columns, symbolic)]
+        if mask is not None:
+            cols = [c[mask] for c in cols]
+        ok = np.ones(len(cols[0]), dtype=bool)
+        for c, s in zip(cols, symbolic):
+            if s:
+                ok &= c >= 0
+        keys, counts = np.unique(np.stack([c[ok] for c in cols], axis=1), axis=0, return_counts=True)
+        # only distinct keys are mapped from chat codes to run codes
+        for j, (c, s) in enumerate(zip(columns, symbolic)):
+            if s:
+                keys[:, j] = SYMBOLS.mapping(c)[keys[:, j]]
+        return cls(keys, counts.astype(np.int64), symbolic)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def column(self, j: int) -> np.ndarray:
+        return self.keys[:, j]
+
+    def labels(self, j: int) -> np.ndarray:
+        """Column `j` as labels (for plotting)."""
+        return SYMBOLS.label(self.keys[:, j])
+
+    def merge(self, other: "CodeCounts") -> "CodeCounts":
+        keys, inv = np.unique(np.concatenate([self.keys, other.keys]), axis=0, return_inverse=True)
+        counts = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(counts, inv.reshape(-1), np.concatenate([self.counts, other.counts]))
+        self.keys, self.counts = keys, counts
+        return self
+
+    def __getstate__(self) -> dict:
+        cols = [SYMBOLS.label(self.keys[:, j]).tolist() if s else self.keys[:, j]
+                for j, s in enumerate(self.symbolic)]
+        return {"columns": cols, "counts": self.counts, "symbolic": self.symbolic}
+
+    def __setstate__(self, state: dict) -> None:
+        cols = [SYMBOLS.intern(c).astype(np.int64) if s else np.asarray(c, dtype=np.int64)
+                for c, s in zip(state["columns"], state["symbolic"])]
+        self.keys = np.stack(cols, axis=1) if cols and len(state["counts"]) else \
+            np.zeros((0, len(state["symbolic"])), dtype=np.int64)
+        self.counts = state["counts"]
+        self.symbolic = state["symbolic"]
@@ -0,0 +1,546 @@
+import calendar
+from array import array
+from dataclasses import dataclass, fields, replace
+from datetime import datetime
+from functools import cached_property
+from typing import AbstractSet, Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .corpus import Corpus, build_corpus
+
+# int64 value of NaT: rows without a parseable date
+MISSING_TS = np.iinfo(np.int64).min
+
+# fallback date strings are parsed in batches so they never pile up
+_DATE_BATCH = 100_000
+
+# Columns a table can be built without; `id` and `ts` are always loaded.
+# Columns of one group are filled by the same code and loaded together.
+OPTIONAL_COLUMNS = ("type", "from_id", "from_name", "action", "text", "text_len",
+                    "n_hashtags", "n_mentions", "mentions", "mention_row")
+_COLUMN_GROUPS = ({"mentions", "mention_row"},)
+
+_SECONDS_PER_DAY = 86400
+# 1970-01-01 was a Thursday (Mon=0)
+_EPOCH_WEEKDAY = 3
+
+
+def month_index(ts: np.ndarray) -> np.ndarray:
+    """Months since 1970-01 for each timestamp."""
+    return ts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+
+
+def weekday_index(ts: np.ndarray) -> np.ndarray:
+    """Day of week (0=Mon ... 6=Sun) for each timestamp."""
+    return (ts // _SECONDS_PER_DAY + _EPOCH_WEEKDAY) % 7
+
+
+def hour_index(ts: np.ndarray) -> np.ndarray:
+    """Hour of day (0-23) for each timestamp."""
+    return (ts // 3600) % 24
+
+
+def month_starts(months: Any) -> pd.DatetimeIndex:
+    """First day of each month index, for plotting."""
+    m = np.asarray(months, dtype=np.int64).astype("datetime64[M]")
+    return pd.DatetimeIndex(m.astype("datetime64[s]"))
+
+
+def text_to_str(t: Union[str, List[Any], Dict[str, Any], None]) -> str:
+    """Extract plain text from Telegram export's 'text' field of mixed types."""
+    if t is None:
+        return ""
+    if isinstance(t, str):
+        return t
+    if isinstance(t, list):
+        parts: List[str] = []
+        for it in t:
+            if isinstance(it, str):
+                parts.append(it)
+            elif isinstance(it, dict):
+                parts.append(text_to_str(it.get("text")))
+        return "".join(parts)
+    if isinstance(t, dict):
+        return text_to_str(t.get("text"))
+    return ""
+
+
+class PackedStrings(Sequence[str]):
+    """Read-only list of strings stored as one UTF-8 buffer plus offsets."""
+
+    _CHUNK = 65536
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data          # uint8
+        self.offsets = offsets    # int64, len(self) + 1 entries
+
+    @classmethod
+    def pack(cls, strings: Iterable[str]) -> "PackedStrings":
+        data = bytearray()
+        offsets = array("q", [0])
+        for s in strings:
+            data += s.encode("utf-8")
+            offsets.append(len(data))
+        return cls(np.frombuffer(bytes(data), dtype=np.uint8), np.frombuffer(offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def view(self, start: int, stop: int) -> "PackedStrings":
+        """Strings start..stop-1 sharing this buffer (nothing is copied)."""
+        return PackedStrings(self.data, self.offsets[start:stop + 1])
+
+    def __getitem__(self, i):  # type: ignore[override]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        n = len(self)
+        for start in range(0, n, self._CHUNK):
+            offs = self.offsets[start:min(start + self._CHUNK, n) + 1].tolist()
+            base = offs[0]
+            raw = self.data[base:offs[-1]].tobytes()
+            for a, b in zip(offs, offs[1:]):
+                yield raw[a - base:b - base].decode("utf-8")
+
+
+class _Interner:
+    """Map strings to dense int codes (-1 = missing)."""
+
+    def __init__(self) -> None:
+        self.index: Dict[str, int] = {}
+        self.codes = array("i")
+
+    def add(self, s: Optional[str]) -> None:
+        if s is None:
+            self.codes.append(-1)
+            return
+        code = self.index.get(s)
+        if code is None:
+            code = self.index[s] = len(self.index)
+        self.codes.append(code)
+
+    def categorical(self) -> pd.Categorical:
+        return pd.Categorical.from_codes(
+            np.frombuffer(self.codes, dtype=np.int32),
+            categories=pd.Index(list(self.index), dtype=object),
+        )
+
+
+@dataclass
+class Partition:
+    """
+    Rows of a categorical column grouped by label: the rows of category
+    code k are rows[starts[k]:starts[k + 1]], ascending. Rows without a
+    value (code -1) belong to no group.
+    """
+    rows: np.ndarray       # row indices, grouped by code
+    starts: np.ndarray     # int64, one per category + 1
+    codes: Dict[str, int]  # label -> category code
+
+    @classmethod
+    def of(cls, cat: pd.Categorical) -> "Partition":
+        codes = np.asarray(cat.codes)
+        order = np.argsort(codes, kind="stable")
+        sizes = np.bincount(codes + 1, minlength=len(cat.categories) + 1)
+        starts = np.cumsum(sizes)  # starts[0]: rows with code -1, sorted first
+        return cls(order[starts[0]:], starts - starts[0],
+                   {str(c): i for i, c in enumerate(cat.categories)})
+
+    def rows_of(self, *labels: str) -> np.ndarray:
+        """Ascending rows holding any of `labels` (unknown labels have none)."""
+        parts = [self.rows[self.starts[k]:self.starts[k + 1]]
+                 for k in (self.codes.get(label) for label in labels) if k is not None]
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.intp)
+
+
+def _parse_dates(dates: List[Optional[str]]) -> np.ndarray:
+    parsed = pd.to_datetime(pd.Series(dates, dtype=object), errors="coerce")
+    return parsed.to_numpy(dtype="datetime64[s]").astype(np.int64)
+
+
+def _wall_clock(date_str: str) -> Optional[int]:
+    """Seconds since epoch of an ISO `date` taken as naive wall-clock time."""
+    try:
+        return calendar.timegm(datetime.fromisoformat(date_str).timetuple())
+    except ValueError:
+        return None
+
+
+class _Clock:
+    """
+    Turn `date_unixtime` into the export's wall-clock seconds.
+
+    `date` is local time of the exporting machine while `date_unixtime` is
+    UTC. The local offset is taken from a parsed `date` and re-derived only
+    when the hour in the `date` string stops matching (DST switch).
+    """
+
+    def __init__(self) -> None:
+        self.offset: Optional[int] = None
+
+    def ts(self, unixtime: Any, date_str: Any) -> Optional[int]:
+        try:
+            u = int(unixtime)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(date_str, str):
+            return u if self.offset is None else u + self.offset
+        if self.offset is not None:
+            t = u + self.offset
+            if date_str[11:13] == f"{t // 3600 % 24:02d}":
+                return t
+        wall = _wall_clock(date_str)
+        if wall is None:
+            return None
+        self.offset = wall - u
+        return wall
+
+
+def resolve_columns(columns: Optional[Iterable[str]]) -> FrozenSet[str]:
+    """Optional columns to load for the requested names (None: all of them)."""
+    if columns is None:
+        return frozenset(OPTIONAL_COLUMNS)
+    wanted = set(columns)
+    unknown = wanted - set(OPTIONAL_COLUMNS) - {"id", "ts"}
+    if unknown:
+        raise ValueError(f"unknown table columns: {', '.join(sorted(unknown))}")
+    for group in _COLUMN_GROUPS:
+        if wanted & group:
+            wanted |= group
+    return frozenset(wanted & set(OPTIONAL_COLUMNS))
+
+
+class Unloaded:
+    """
+    Placeholder of a column left out of a projected table: any use of it
+    fails with the column name instead of silently matching nothing.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _fail(self, *args: Any, **kwargs: Any) -> Any:
+        raise LookupError(f"table column {self.name!r} was not loaded; "
+                          f"add it to the `columns` of the processor reading it")
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        self._fail()
+
+    __getitem__ = __len__ = __iter__ = __array__ = _fail
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = _fail
+    __hash__ = object.__hash__
+
+    def __repr__(self) -> str:
+        return f"Unloaded({self.name!r})"
+
+
+@dataclass
+class MessageTable:
+    """
+    Typed columnar view of one chat, built once and shared by all processors.
+
+    One row per message. `ts` holds seconds since epoch of the export's
+    wall-clock `date` (MISSING_TS when absent); month/weekday/hour buckets
+    are derived from it with integer arithmetic. String-like columns are
+    categoricals, i.e. interned codes + a single copy of every label.
+    A projected table holds Unloaded placeholders for the columns no
+    processor of the run reads.
+    """
+    id: np.ndarray                 # int64
+    ts: np.ndarray                 # int64
+    type: pd.Categorical
+    from_id: pd.Categorical        # NaN when absent
+    from_name: pd.Categorical      # stripped 'from', "" when absent
+    action: pd.Categorical         # NaN for non-service rows
+    text: Sequence[str]            # plain visible text, "" when none
+    text_len: np.ndarray           # int32
+    n_hashtags: np.ndarray         # int32
+    n_mentions: np.ndarray         # int32
+    mentions: pd.Categorical       # flat list of @handles ...
+    mention_row: np.ndarray        # ... and the row each one belongs to (int32)
+    end_offset: int = -1           # byte offset past the last message of the .json, -1 if unknown
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @property
+    def columns(self) -> FrozenSet[str]:
+        """Optional columns present in this table."""
+        return frozenset(c for c in OPTIONAL_COLUMNS if not isinstance(getattr(self, c), Unloaded))
+
+    @cached_property
+    def has_date(self) -> np.ndarray:
+        return self.ts != MISSING_TS
+
+    @cached_property
+    def month(self) -> np.ndarray:
+        return month_index(self.ts)
+
+    @cached_property
+    def weekday(self) -> np.ndarray:
+        return weekday_index(self.ts)
+
+    @cached_property
+    def hour(self) -> np.ndarray:
+        return hour_index(self.ts)
+
+    @cached_property
+    def by_type(self) -> Partition:
+        """Rows per message type; main.py builds it before forking."""
+        return Partition.of(self.type)
+
+    @cached_property
+    def by_action(self) -> Partition:
+        """Rows per service action; main.py builds it before forking."""
+        return Partition.of(self.action)
+
+    def service_rows(self, *actions: str) -> np.ndarray:
+        """Ascending rows of service messages with any of `actions`."""
+        rows = self.by_action.rows_of(*actions)
+        return np.intersect1d(rows, self.by_type.rows_of("service"), assume_unique=True)
+
+    @cached_property
+    def corpus(self) -> Corpus:
+        """Tokenized texts; main.py builds it before forking when text processors run."""
+        return build_corpus(self.text)
+
+    @cached_property
+    def ts_sorted(self) -> bool:
+        """True when `ts` never decreases (undated rows only before the first dated one)."""
+        return bool(np.all(self.ts[1:] >= self.ts[:-1]))
+
+    def window(self, start: Optional[int] = None, stop: Optional[int] = None) -> "MessageTable":
+        """
+        Dated rows with start <= ts < stop (None: unbounded) as a table.
+
+        Exports are in chronological order, so the rows are found by binary
+        search on `ts` and every column is sliced as a view: the cost is
+        proportional to the window, not to the chat. Cached derived columns
+        (month, corpus, ...) are sliced along instead of recomputed. Tables
+        with out-of-order dates fall back to a mask over all rows.
+        """
+        return self._take(self._window_rows(start, stop))
+
+    def window_size(self, start: Optional[int] = None, stop: Optional[int] = None) -> int:
+        """Number of rows window(start, stop) has, without building it."""
+        rows = self._window_rows(start, stop)
+        return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+    def _window_rows(self, start: Optional[int], stop: Optional[int]) -> Union[slice, np.ndarray]:
+        lo_ts = MISSING_TS + 1 if start is None else max(start, MISSING_TS + 1)
+        hi_ts = np.iinfo(np.int64).max if stop is None else stop
+        if not self.ts_sorted:
+            return np.flatnonzero((self.ts >= lo_ts) & (self.ts < hi_ts))
+        lo, hi = np.searchsorted(self.ts, [lo_ts, hi_ts]).tolist()
+        return slice(lo, max(lo, hi))
+
+    def _take(self, rows: Union[slice, np.ndarray]) -> "MessageTable":
+        """Table of `rows`, in that order (a slice is taken as views, an index array is copied)."""
+        is_slice = isinstance(rows, slice)
+        cols: Dict[str, Any] = {}
+        for f in fields(self):
+            v = getattr(self, f.name)
+            if f.name in ("end_offset", "mentions", "mention_row") or isinstance(v, Unloaded):
+                continue
+            if f.name == "text" and not is_slice:
+                cols[f.name] = [v[i] for i in rows.tolist()]
+            elif f.name == "text" and isinstance(v, PackedStrings):
+                cols[f.name] = v.view(rows.start, rows.stop)
+            else:
+                cols[f.name] = v[rows]
+
+        if not isinstance(self.mention_row, Unloaded):
+            # mention_row is ascending: the mentions of a row range are a range too
+            if is_slice:
+                a, b = np.searchsorted(self.mention_row, [rows.start, rows.stop]).tolist()
+                cols["mentions"] = self.mentions[a:b]
+                cols["mention_row"] = self.mention_row[a:b] - np.int32(rows.start)
+            else:
+                new_row = np.full(len(self), -1, dtype=np.int64)
+                new_row[rows] = np.arange(len(rows))
+                moved = new_row[self.mention_row]
+                order = np.flatnonzero(moved >= 0)
+                order = order[np.argsort(moved[order], kind="stable")]
+                cols["mentions"] = self.mentions[order]
+                cols["mention_row"] = moved[order].astype(np.int32)
+
+        out = replace(self, **cols)
+        # derived columns computed on this table already are not recomputed
+        for name in ("has_date", "month", "weekday", "hour"):
+            if name in self.__dict__:
+                out.__dict__[name] = self.__dict__[name][rows]
+        if "corpus" in self.__dict__:
+            out.__dict__["corpus"] = self.corpus.take(rows)
+        return out
+
+
+def build_message_table(messages: Iterable[Dict[str, Any]],
+                        columns: Optional[AbstractSet[str]] = None) -> MessageTable:
+    """
+    Single pass over raw messages into a MessageTable.
+
+    With `columns` only those optional columns are extracted (see
+    resolve_columns); the fields of a message nobody reads are never
+    looked at, and the message dict is dropped right after its row.
+    """
+    want = resolve_columns(columns)
+    want_text = "text" in want or "text_len" in want
+    want_entities = bool(want & {"n_hashtags", "n_mentions", "mentions"})
+    ids = array("q")
+    ts = array("q")
+    text_len = array("i")
+    n_hashtags = array("i")
+    n_mentions = array("i")
+    mention_row = array("i")
+    texts: List[str] = []
+    types, from_ids, from_names, actions, mentions = (_Interner() for _ in range(5))
+
+    clock = _Clock()
+    # old exports without date_unixtime: rows + strings for pd.to_datetime
+    fallback_rows = array("q")
+    fallback_ts = array("q")
+    pending: List[str] = []
+
+    for row, m in enumerate(messages):
+        mid = m.get("id")
+        ids.append(mid if isinstance(mid, int) else -1)
+
+        d = m.get("date")
+        t = clock.ts(m["date_unixtime"], d) if "date_unixtime" in m else None
+        if t is not None:
+            ts.append(t)
+        else:
+            ts.append(MISSING_TS)
+            if isinstance(d, str):
+                fallback_rows.append(row)
+                pending.append(d)
+                if len(pending) >= _DATE_BATCH:
+                    fallback_ts.frombytes(_parse_dates(pending).tobytes())
+                    pending = []
+
+        if "type" in want:
+            typ = m.get("type")
+            types.add(typ if isinstance(typ, str) else None)
+        if "from_id" in want:
+            fid = m.get("from_id")
+            from_ids.add(str(fid) if fid is not None else None)
+        if "from_name" in want:
+            from_names.add((m.get("from") or "").strip())
+        if "action" in want:
+            action = m.get("action")
+            actions.add(str(action) if action else None)
+
+        if want_text:
+            txt = text_to_str(m.get("text"))
+            if "text" in want:
+                texts.append(txt)
+            text_len.append(len(txt))
+
+        if not want_entities:
+            continue
+        hashtags = mentioned = 0
+        entities = m.get("text_entities")
+        if isinstance(entities, list):
+            for e in entities:
+                if not isinstance(e, dict):
+                    continue
+                etype = e.get("type")
+                if etype == "hashtag":
+                    hashtags += 1
+                elif etype in ("mention", "mention_name"):
+                    handle = e.get("text")
+                    if isinstance(handle, str) and handle.strip():
+                        mentions.add(handle.strip())
+                        mention_row.append(row)
+                        mentioned += 1
+        n_hashtags.append(hashtags)
+        n_mentions.append(mentioned)
+
+    if pending:
+        fallback_ts.frombytes(_parse_dates(pending).tobytes())
+
+    ts_arr = np.frombuffer(ts, dtype=np.int64)
+    if fallback_rows:
+        ts_arr = ts_arr.copy()
+        ts_arr[np.frombuffer(fallback_rows, dtype=np.int64)] = np.frombuffer(fallback_ts, dtype=np.int64)
+
+    cols: Dict[str, Any] = dict(
+        type=types.categorical(),
+        from_id=from_ids.categorical(),
+        from_name=from_names.categorical(),
+        action=actions.categorical(),
+        text=texts,
+        text_len=np.frombuffer(text_len, dtype=np.int32),
+        n_hashtags=np.frombuffer(n_hashtags, dtype=np.int32),
+        n_mentions=np.frombuffer(n_mentions, dtype=np.int32),
+        mentions=mentions.categorical(),
+        mention_row=np.frombuffer(mention_row, dtype=np.int32),
+    )
+    return MessageTable(
+        id=np.frombuffer(ids, dtype=np.int64),
+        ts=ts_arr,
+        **{name: v if name in want else Unloaded(name) for name, v in cols.items()},
+    )
+
+
+def _concat_categoricals(cats: List[pd.Categorical]) -> pd.Categorical:
+    """Categoricals of several tables as one, over the union of their labels."""
+    labels: Dict[str, int] = {}
+    parts = []
+    for c in cats:
+        remap = np.fromiter((labels.setdefault(str(x), len(labels)) for x in c.categories),
+                            dtype=np.int32, count=len(c.categories))
+        # the extra last entry maps code -1 (missing) to itself
+        parts.append(np.append(remap, np.int32(-1))[np.asarray(c.codes)])
+    return pd.Categorical.from_codes(np.concatenate(parts).astype(np.int32),
+                                     categories=pd.Index(list(labels), dtype=object))
+
+
+def concat_tables(tables: Sequence[MessageTable]) -> MessageTable:
+    """
+    Tables of the shards of one export as one table ordered by message id.
+
+    Shards usually cover consecutive id ranges and are only concatenated;
+    otherwise rows are sorted by id (stably, rows without an id first). A
+    message present in several shards is kept once.
+    """
+    if len(tables) == 1:
+        return tables[0]
+    first = tables[0]
+    starts = np.cumsum([0] + [len(t) for t in tables])
+    cols: Dict[str, Any] = {}
+    for f in fields(first):
+        v = getattr(first, f.name)
+        if f.name == "end_offset" or isinstance(v, Unloaded):
+            continue
+        parts = [getattr(t, f.name) for t in tables]
+        if isinstance(v, pd.Categorical):
+            cols[f.name] = _concat_categoricals(parts)
+        elif f.name == "text":
+            cols[f.name] = [s for p in parts for s in p]
+        elif f.name == "mention_row":
+            cols[f.name] = np.concatenate([p + np.int32(s) for p, s in zip(parts, starts)]).astype(np.int32)
+        else:
+            cols[f.name] = np.concatenate(parts)
+    merged = replace(first, **cols, end_offset=-1)
+
+    ids = merged.id
+    order = np.argsort(ids, kind="stable")
+    ids_sorted = ids[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (ids_sorted[1:] != ids_sorted[:-1]) | (ids_sorted[1:] < 0)
+    if keep.all() and bool(np.all(order[1:] > order[:-1])):
+        return merged
+    return merged._take(order[keep])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: time from interpreter start to a ready processor.
+
+Every sample is a fresh interpreter that imports main.py and resolves
+the given graphics through the lazy registry ("lazy"), compared with
+importing every processor module up front as before ("eager").
+
+    python3 benchmarks/startup.py --graphics messages_per_hour --repeat 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+from processors.registry import REGISTRY
+for gid in {ids!r}:
+    REGISTRY[gid]
+print(time.perf_counter() - t0)
+"""
+
+
+def sample(ids: List[str]) -> float:
+    """Seconds one fresh interpreter needs to import main and resolve `ids`."""
+    out = subprocess.run(
+        [sys.executable, "-c", _SNIPPET.format(ids=ids)],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--graphics", nargs="+", default=["messages_per_hour"],
+                        help="processor ids resolved in the lazy case")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", type=Path, default=None, help="also write results to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    from processors.registry import MODULES
+
+    cases = {"lazy": list(args.graphics), "eager": list(MODULES)}
+    sample(cases["lazy"])  # warm the OS file cache
+    results: Dict[str, Dict[str, float]] = {}
+    for name, ids in cases.items():
+        times = [sample(ids) for _ in range(args.repeat)]
+        results[name] = {"median_s": statistics.median(times), "min_s": min(times), "max_s": max(times)}
+        print(f"{name:>5}: median {results[name]['median_s']:.3f}s  "
+              f"(min {results[name]['min_s']:.3f}s, max {results[name]['max_s']:.3f}s, {len(ids)} processors)")
+
+    gain = results["eager"]["median_s"] - results["lazy"]["median_s"]
+    print(f" gain: {gain:.3f}s per invocation")
+    if args.json:
+        args.json.write_text(json.dumps({"graphics": args.graphics, "repeat": args.repeat, **results}, indent=2),
+                             encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: how each stage of the analyser scales with chat size.
+
+For every size a synthetic export is generated (once, under --data-dir)
+and these stages are measured separately, each in a forked child process
+so that peak memory is attributed to that stage alone:
+
+  load_messages     parse the export into a list of dicts
+  load_table        stream the export into a MessageTable (what main.py does)
+  aggregate         all declarative counters of all processors in one pass
+  <processor id>    every registered processor, fed the same table
+  build_index_html  the HTML index over the rendered charts
+
+Results (seconds, CPU seconds, messages per second, peak memory above the
+child's starting RSS) are printed and written as JSON for tracking
+regressions between versions.
+
+    python3 benchmarks/suite.py --sizes 10k 1m --out bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from analyser.aggregate import aggregate  # noqa: E402
+from analyser.io_loader import load_messages  # noqa: E402
+from analyser.pipeline import load_table  # noqa: E402
+from analyser.report import peak_rss_kb, reset_peak_rss  # noqa: E402
+from analyser.runner import run_processor  # noqa: E402
+from analyser.webindex import build_index_html  # noqa: E402
+from benchmarks.synth import SIZES, ensure_export, parse_size  # noqa: E402
+from processors.registry import MODULES, REGISTRY  # noqa: E402
+
+
+def measure(fn: Callable[[], Any]) -> Dict[str, Any]:
+    """Run `fn` in a forked child; wall/CPU time and peak memory of that child."""
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            base = reset_peak_rss()
+            t0, c0 = time.perf_counter(), time.process_time()
+            fn()
+            res: Dict[str, Any] = {
+                "seconds": time.perf_counter() - t0,
+                "cpu_seconds": time.process_time() - c0,
+                "peak_mb": max(0, peak_rss_kb() - base) / 1024,
+            }
+        except BaseException:
+            res = {"error": traceback.format_exc()}
+        with os.fdopen(w, "w", encoding="utf-8") as out:
+            out.write(json.dumps(res))
+        os._exit(0)
+
+    os.close(w)
+    with os.fdopen(r, encoding="utf-8") as inp:
+        data = inp.read()
+    _, status = os.waitpid(pid, 0)
+    if not data:
+        return {"error": f"child exited with status {status}"}
+    return json.loads(data)
+
+
+def _git_version() -> str:
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_size(export: Path, n: int, processors: List[str], skip: List[str]) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+
+    def record(stage: str, fn: Callable[[], Any]) -> None:
+        if stage in skip:
+            return
+        res = measure(fn)
+        res.update(stage=stage, messages=n)
+        if "seconds" in res:
+            res["msgs_per_s"] = n / res["seconds"] if res["seconds"] > 0 else None
+            print(f"  {stage:<36} {res['seconds']:9.3f}s  {res['msgs_per_s'] or 0:12,.0f} msg/s  "
+                  f"{res['peak_mb']:9.1f} MB")
+        else:
+            print(f"  {stage:<36} failed:\n{res['error']}")
+        rows.append(res)
+
+    record("load_messages", lambda: load_messages(export))
+    record("load_table", lambda: load_table(export))
+
+    # processors share one table built here; children see it copy-on-write
+    table = load_table(export)
+    counts = [c for pid in processors for c in REGISTRY[pid].counts]
+    record("aggregate", lambda: aggregate(table, counts))
+
+    with tempfile.TemporaryDirectory(prefix="tg-bench-") as tmp:
+        out_dir = Path(tmp) / export.stem
+        out_dir.mkdir()
+        ctx = {"chat_file": export.name, "chat_name": "Synthetic chat", "channel_type": "public"}
+        for pid in processors:
+            record(pid, lambda pid=pid: run_processor(pid, table, out_dir, ctx))
+        record("build_index_html", lambda: build_index_html(Path(tmp), [out_dir]))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES),
+                        help="chat sizes: message counts or " + ", ".join(SIZES))
+    parser.add_argument("--processors", nargs="+", default=list(MODULES), help="processor ids to time")
+    parser.add_argument("--skip", nargs="+", default=[],
+                        help="stages to skip (e.g. load_messages, which holds every message dict in memory)")
+    parser.add_argument("--data-dir", type=Path, default=ROOT / "benchmarks" / "data",
+                        help="where generated exports are kept between runs")
+    parser.add_argument("--out", type=Path, default=ROOT / "benchmarks" / "results.json")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "version": _git_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": [],
+    }
+    for size in args.sizes:
+        n = parse_size(size)
+        export = ensure_export(args.data_dir / f"synthetic_{n}.json", n)
+        print(f"[bench] {n:,} messages ({export.stat().st_size / 2 ** 20:,.0f} MB)")
+        report["results"].extend(bench_size(export, n, args.processors, args.skip))
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[bench] results: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
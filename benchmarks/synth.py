@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Synthetic Telegram exports for benchmarks.
+
+Messages are written one by one, so even 10M-message exports are produced
+with constant memory. The mix resembles a busy public supergroup: Zipf-like
+user activity, Cyrillic and Latin text, list-form `text` with hashtags,
+mentions, links and formatting, replies, pins and join/leave service
+messages, with `date` and `date_unixtime` in a UTC+3 local time.
+
+    python3 benchmarks/synth.py 1m -o /tmp/chat_1m.json
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, TextIO
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+_TZ = timezone(timedelta(hours=3))
+_START = datetime(2019, 1, 1, tzinfo=_TZ)
+_SPAN_DAYS = 6 * 365
+
+_WORDS_RU = (
+    "привет работа вакансия зарплата офер команда стартап проект продукт релиз задача срок бэкенд фронтенд "
+    "данные модель метрика рост выручка инвестор раунд питч найм собеседование удалёнка офис переезд виза "
+    "ёлка отпуск выгорание менеджер разработчик аналитик дизайнер тестировщик ревью спринт дедлайн"
+).split()
+_WORDS_EN = (
+    "hello team job salary offer startup product release python golang kubernetes data model metric growth "
+    "revenue investor round pitch hiring interview remote office relocation visa backend frontend review"
+).split()
+_HASHTAGS = ["#вакансия", "#job", "#remote", "#резюме", "#python", "#стартап", "#hiring", "#офер"]
+_FIRST = ["Анна", "Иван", "Мария", "Дмитрий", "Ольга", "Алексей", "Alex", "John", "Maria", "Kate", "Max", "Nik"]
+_LAST = ["Иванова", "Петров", "Смирнова", "Кузнецов", "Smith", "Brown", "Lee", "Novak", "", ""]
+_JOIN = ["invite", "join_group_by_link"]
+_LEAVE = ["remove_member", "leave"]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = _WORDS_RU if rng.random() < 0.7 else _WORDS_EN
+    n = max(1, int(rng.expovariate(1 / 9)))
+    return " ".join(rng.choice(words) for _ in range(n))
+
+
+def _rich_text(rng: random.Random, n_users: int) -> List[Dict[str, str]]:
+    """Entities of a formatted message; `text` is their list form."""
+    parts = [{"type": "plain", "text": _sentence(rng) + " "}]
+    for _ in range(rng.randint(1, 3)):
+        kind = rng.random()
+        if kind < 0.35:
+            parts.append({"type": "hashtag", "text": rng.choice(_HASHTAGS)})
+        elif kind < 0.7:
+            parts.append({"type": "mention", "text": f"@user{int(rng.paretovariate(1.2)) % n_users}"})
+        elif kind < 0.85:
+            parts.append({"type": "link", "text": f"https://example.com/{rng.randint(1, 9999)}"})
+        else:
+            parts.append({"type": "bold", "text": _sentence(rng)})
+        parts.append({"type": "plain", "text": " " + _sentence(rng) + " "})
+    return parts
+
+
+def _user(rng: random.Random, n_users: int) -> int:
+    # a few very active users and a long tail
+    return int(rng.paretovariate(1.1)) % n_users
+
+
+def _name(uid: int) -> str:
+    r = random.Random(uid)
+    return f"{r.choice(_FIRST)} {r.choice(_LAST)}".strip()
+
+
+def iter_messages(n: int, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    n_users = max(50, n // 40)
+    step = _SPAN_DAYS * 86400 / n
+    t = _START.timestamp()
+    for mid in range(1, n + 1):
+        t += rng.expovariate(1 / step)
+        dt = datetime.fromtimestamp(int(t), _TZ)
+        base = {
+            "id": mid,
+            "date": dt.strftime("%Y-%m-%dT%H:%M:%S"),
+            "date_unixtime": str(int(t)),
+        }
+        uid = _user(rng, n_users)
+        r = rng.random()
+        if r < 0.08:
+            if r < 0.01:
+                action, extra = "pin_message", {"message_id": rng.randint(1, mid)}
+            elif r < 0.055:
+                action, extra = rng.choice(_JOIN), {"members": [_name(uid)]}
+            else:
+                action, extra = rng.choice(_LEAVE), {"members": [_name(uid)]}
+            yield {**base, "type": "service", "actor": _name(uid), "actor_id": f"user{uid}",
+                   "action": action, **extra, "text": "", "text_entities": []}
+            continue
+
+        msg = {**base, "type": "message", "from": _name(uid), "from_id": f"user{uid}"}
+        if rng.random() < 0.15 and mid > 1:
+            msg["reply_to_message_id"] = rng.randint(max(1, mid - 500), mid - 1)
+        r = rng.random()
+        if r < 0.05:
+            msg["photo"] = f"photos/photo_{mid}.jpg"
+            msg["text"], msg["text_entities"] = "", []
+        elif r < 0.4:
+            ents = _rich_text(rng, n_users)
+            msg["text"] = [e["text"] if e["type"] == "plain" else e for e in ents]
+            msg["text_entities"] = ents
+        else:
+            s = _sentence(rng)
+            msg["text"], msg["text_entities"] = s, [{"type": "plain", "text": s}]
+        yield msg
+
+
+def write_export(out: TextIO, n: int, seed: int = 42) -> None:
+    out.write('{\n "name": "Synthetic chat",\n "type": "public_supergroup",\n "id": 1000000001,\n "messages": [\n')
+    for i, m in enumerate(iter_messages(n, seed)):
+        if i:
+            out.write(",\n")
+        out.write("  ")
+        out.write(json.dumps(m, ensure_ascii=False))
+    out.write("\n ]\n}\n")
+
+
+def ensure_export(path: Path, n: int, seed: int = 42) -> Path:
+    """Generate `path` unless it exists (written to a temp file first)."""
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            write_export(f, n, seed)
+        tmp.replace(path)
+    return path
+
+
+def parse_size(s: str) -> int:
+    return SIZES.get(s.lower()) or int(s)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("size", help="number of messages or one of: " + ", ".join(SIZES))
+    parser.add_argument("-o", "--output", type=Path, required=True)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    with args.output.open("w", encoding="utf-8") as f:
+        write_export(f, parse_size(args.size), args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import sys
+import argparse
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, FrozenSet, Iterable, Optional, Sequence, Tuple, Union
 import shutil
+import time
 
-from analyser.config import load_app_cfg
-from analyser.io_loader import find_input_file, load_messages
+from analyser.aggregate import aggregate
+from analyser.cache import ResultCache, TableCache, as_table, purge_cache
+from analyser.config import ChatCfg, GraphicCfg, load_app_cfg
+from analyser.corpus import build_corpus
+from analyser.io_loader import find_input_files
+from analyser.pipeline import load_table, prefetch
+from analyser.report import ChatRun, RunReport
+from analyser.runner import resolve_workers, run_processors
+from analyser.state import StateStore, Watermark, prefix_check, settings_digest
+from analyser.table import MessageTable
 from processors.registry import REGISTRY
 from analyser.webindex import build_index_html
 
 
-def run_processor(name: str, messages, out_dir: Path, context: Dict[str, Any]) -> None:
-    """Instantiate and run a processor by its registry id."""
-    cls = REGISTRY.get(name)
-    if not cls:
-        print(f"[warn] unknown processor: {name} (skip)")
-        return
-    try:
-        inst = cls(output_dir=out_dir, **context)
-    except TypeError:
-        inst = cls(output_dir=out_dir)
-    try:
-        inst.run(messages, **context)
-    except TypeError:
-        inst.run(messages)
-
-
 def clear_dir_contents(p: Path) -> None:
     """Delete directory completely and recreate it."""
     if p.exists():
@@ -34,13 +28,113 @@ def clear_dir_contents(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
+def is_incremental(gid: str) -> bool:
+    return bool(getattr(REGISTRY.get(gid), "incremental", False))
+
+
+def appendable(files: List[Path]) -> bool:
+    """Only a single uncompressed .json export can be read on from a saved byte offset."""
+    return len(files) == 1 and files[0].suffix.lower() == ".json"
+
+
+def export_source(files: List[Path]) -> Union[Path, List[Path]]:
+    """What loaders take: the file of a single-file export, else the list of shards."""
+    return files[0] if len(files) == 1 else files
+
+
+def table_columns(graphics: Iterable[GraphicCfg]) -> FrozenSet[str]:
+    """Optional table columns read by any of `graphics`."""
+    cols: FrozenSet[str] = frozenset()
+    for g in graphics:
+        cls = REGISTRY.get(g.id)
+        if cls is not None:
+            cols |= cls.required_columns()
+    return cols
+
+
+def state_settings(g: GraphicCfg) -> str:
+    params = {**g.params, "window": [g.window.start, g.window.end]} if g.window else g.params
+    return settings_digest(getattr(REGISTRY.get(g.id), "version", 0), params)
+
+
+def resumable(g: GraphicCfg) -> bool:
+    """Saved state can be extended with new messages (a relative window moves with them)."""
+    return is_incremental(g.id) and not (g.window and g.window.relative)
+
+
+def graphic_params(g: GraphicCfg, table: MessageTable) -> Dict[str, Any]:
+    """Processor settings, plus the (start, stop) timestamps of its window in this chat."""
+    if g.window is None:
+        return g.params
+    dated = table.ts[table.has_date]
+    last = int(dated.max()) if dated.size else 0
+    return {**g.params, "window": g.window.bounds(last)}
+
+
+def save_watermark(store: StateStore, in_file: Path, table: MessageTable, old: Optional[Watermark],
+                   done: Dict[str, str]) -> None:
+    """
+    Record that the states of `done` processors (id -> settings digest)
+    cover the export up to `table`'s last message.
+    """
+    ids = [old.max_id] if old else []
+    if len(table):
+        ids.append(int(table.id.max()))
+    offset = table.end_offset
+
+    # processors restored from the result cache did not run; their state
+    # from the previous run is still current if it covers the same bytes
+    prev = store.watermark()
+    states: Dict[str, str] = {}
+    for gid in done:
+        if store.saved(gid):
+            states[gid] = store.state_file(gid)
+        elif prev and prev.offset == offset and gid in prev.states and prev.settings.get(gid) == done[gid]:
+            states[gid] = prev.states[gid]
+
+    store.commit(Watermark(
+        max_id=max(ids, default=-1),
+        offset=offset,
+        check=prefix_check(in_file, offset) if offset > 0 else "",
+        states=states,
+        settings={gid: done[gid] for gid in states},
+    ))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telegram chat analyser")
+    parser.add_argument("config", type=Path, help="path to config.yaml")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processors to run in parallel (overrides config; 0 = one per CPU)")
+    parser.add_argument("--chats-in-flight", type=int, default=None,
+                        help="chats loaded/processed at once, next exports load in background (overrides config)")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="re-parse exports, re-render charts and overwrite their cache entries")
+    parser.add_argument("--purge-cache", action="store_true",
+                        help="delete cache_dir and exit")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore saved state and recompute every chat from its first message")
+    parser.add_argument("--profile", action="append", default=[], metavar="PROCESSOR",
+                        help="run this processor under cProfile (repeatable); stats go to output_dir/profiles")
+    parser.add_argument("--metrics-file", type=Path, default=None,
+                        help="write run metrics as a Prometheus textfile here (overrides config)")
+    return parser.parse_args()
+
+
 def main() -> None:
-    if len(sys.argv) < 2:
-        print("Usage: python -m analyser.main <config.yaml>")
-        sys.exit(1)
+    args = parse_args()
+    cfg = load_app_cfg(args.config)
+    if args.workers is not None:
+        cfg.workers = args.workers
+    if args.chats_in_flight is not None:
+        cfg.chats_in_flight = max(1, args.chats_in_flight)
+    if args.metrics_file is not None:
+        cfg.metrics_file = args.metrics_file
 
-    cfg_path = Path(sys.argv[1])
-    cfg = load_app_cfg(cfg_path)
+    if args.purge_cache:
+        purge_cache(cfg.cache_dir)
+        print(f"[info] purged cache: {cfg.cache_dir}")
+        return
 
     if not cfg.input_dir.exists():
         raise SystemExit(f"input_dir does not exist: {cfg.input_dir}")
@@ -58,38 +152,149 @@ def main() -> None:
     print(f"[info] output_dir: {cfg.output_dir}")
     print(f"[info] graphics:   {graphics_list}")
     print(f"[info] chats:      {len(cfg.chats)}")
+    print(f"[info] workers:    {resolve_workers(cfg.workers)}")
+    print(f"[info] cache_dir:  {cfg.cache_dir or '(disabled)'}")
+    print(f"[info] state_dir:  {cfg.state_dir or '(disabled)'}")
+    if cfg.window:
+        print(f"[info] window:     {cfg.window.start or '...'} .. {cfg.window.end or '...'}")
+
+    cache = TableCache(cfg.cache_dir, rebuild=args.rebuild_cache) if cfg.cache_dir else None
+    # only the columns some configured processor reads are extracted;
+    # cache entries keep every column and are opened projected
+    columns = table_columns(cfg.graphics or [])
+    print(f"[info] columns:    {', '.join(sorted(columns)) or '(id, ts only)'}")
+    open_loaded = partial(as_table, columns=columns)
+
+    # shards of a split export are decoded in parallel
+    load_workers = resolve_workers(cfg.workers)
 
+    def full_loader(source: Union[Path, Sequence[Path]]) -> Callable[[], Any]:
+        if cache:
+            return partial(cache.ensure, source, workers=load_workers)
+        return partial(load_table, source, columns=columns, workers=load_workers)
+
+    Job = Tuple[ChatCfg, List[Path], List[GraphicCfg], Optional[StateStore], Optional[Watermark]]
+    jobs: List[Tuple[Job, Callable[[], Any]]] = []
     for chat in cfg.chats:
-        in_file = find_input_file(cfg.input_dir, chat.file)
-        if not in_file:
-            print(f"[warn] not found: {cfg.input_dir}/{chat.file}.json")
+        in_files = find_input_files(cfg.input_dir, chat.file)
+        if not in_files:
+            print(f"[warn] not found: {cfg.input_dir / chat.file}")
             continue
+        source = export_source(in_files)
+
+        is_anon = (chat.channel_type == "anonymous")
+        graphics = [g for g in cfg.graphics if not is_anon or getattr(g, "anon", False)]
+
+        # with saved state of every selected processor only the messages
+        # appended to the export since the last run are read; chats that
+        # could never resume (other exports, a non-resumable graphic) keep no state
+        can_resume = appendable(in_files) and all(resumable(g) for g in graphics)
+        store = StateStore(cfg.state_dir / chat.key) if cfg.state_dir and can_resume else None
+        wm = None
+        if store and not args.full:
+            wm = store.resumable(in_files[0], {g.id: state_settings(g) for g in graphics})
+        load = partial(load_table, source, resume_from=wm.offset, columns=columns) if wm else full_loader(source)
+        jobs.append(((chat, in_files, graphics, store, wm), load))
+
+    # each export is streamed once into a table shared by all processors;
+    # the next ones are loaded in background while this one is processed
+    tables = prefetch(jobs, in_flight=cfg.chats_in_flight, finish=open_loaded)
 
-        out_dir = cfg.output_dir / chat.file
+    report = RunReport()
+    waiting_since = time.perf_counter()
+    for (chat, in_files, graphics, store, wm), table in tables:
+        wait_s = time.perf_counter() - waiting_since
+        out_dir = cfg.output_dir / chat.key
         out_dir.mkdir(parents=True, exist_ok=True)
         chat_dirs.append(out_dir)
 
-        print(f"[info] processing: {chat.name} ({chat.channel_type}) <- {in_file.name}")
-        messages = load_messages(in_file)
+        shards = f" ({len(in_files)} files)" if len(in_files) > 1 else ""
+        print(f"[info] processing: {chat.name} ({chat.channel_type}) <- {chat.file}{shards}")
+
+        if chat.channel_type == "anonymous":
+            for g in cfg.graphics:
+                if g not in graphics:
+                    print(f"[skip anonymous] {g.id}")
+
+        if wm and len(table) and int(table.id.min()) <= wm.max_id:
+            print(f"[warn] {chat.file}: new messages do not follow id {wm.max_id}; recomputing")
+            wm = table = None
+            table = open_loaded(full_loader(export_source(in_files))())
+        if wm:
+            print(f"[info] resumed after id {wm.max_id}: {len(table)} new messages")
+
+        # counters of all selected processors are filled in one pass
+        counts = [c for g in graphics for c in getattr(REGISTRY.get(g.id), "counts", ())]
+
+        t0 = time.perf_counter()
+        aggregates = aggregate(table, counts)
+        aggregate_s = time.perf_counter() - t0
+
+        # built once here so forked processors inherit them: rows per
+        # type/action and whether dates are sorted (for date windows)
+        warm = ["ts_sorted"] if any(g.window for g in graphics) else []
+        warm += [f"by_{column}" for column in ("type", "action") if column in table.columns]
+        for name in warm:
+            getattr(table, name)
+
+        # text processors share one tokenization; done here, with all workers,
+        # so forked processors inherit it instead of each tokenizing the chat
+        corpus_s = 0.0
+        workers = resolve_workers(cfg.workers)
+        if workers > 1 and any(getattr(REGISTRY.get(g.id), "uses_corpus", False) for g in graphics):
+            t0 = time.perf_counter()
+            table.corpus = build_corpus(table.text, workers)
+            corpus_s = time.perf_counter() - t0
+
+        # parent-side setup of each processor (e.g. lemmas), inherited by the workers
+        params = {g.id: graphic_params(g, table) for g in graphics}
+        for g in graphics:
+            cls = REGISTRY.get(g.id)
+            if cls is not None:
+                cls.prepare(table, **params[g.id])
 
         ctx: Dict[str, Any] = {
             "chat_file": chat.file,
             "chat_name": chat.name,
             "channel_type": chat.channel_type,
+            "aggregates": aggregates,
+            "state_store": store,
+            "resumed": wm is not None,
         }
 
-        is_anon = (chat.channel_type == "anonymous")
+        # an export with new messages cannot hit the result cache: skip hashing it
+        results = None
+        if cache and not (wm and len(table)):
+            results = ResultCache(cfg.cache_dir, cache.export_fingerprint(in_files),
+                                  rebuild=args.rebuild_cache, chat=chat.key)
 
-        for g in cfg.graphics:
-            if is_anon and not getattr(g, "anon", False):
-                print(f"[skip anonymous] {g.id}")
-                continue
-            run_processor(g.id, messages, out_dir, ctx)
+        profile = {gid: cfg.output_dir / "profiles" / chat.key for gid in args.profile}
+        runs = run_processors([g.id for g in graphics], table, out_dir, ctx,
+                              workers=cfg.workers, results=results, profile=profile,
+                              params=params)
+        if store is not None:
+            done = {g.id: state_settings(g) for g in graphics
+                    if is_incremental(g.id) and runs[g.id].status != "error"}
+            save_watermark(store, in_files[0], table, wm, done)
+
+        report.add(ChatRun(
+            chat=chat.file, name=chat.name, messages=len(table), resumed=wm is not None,
+            wait_s=wait_s, aggregate_s=aggregate_s, corpus_s=corpus_s, processors=list(runs.values()),
+        ))
+        # free this chat before the pipeline hands out the next one
+        del table, ctx, aggregates
+        waiting_since = time.perf_counter()
 
     if getattr(cfg, "need_make_web_page", False):
         build_index_html(cfg.output_dir, chat_dirs)
         print(f"[info] built: {cfg.output_dir / 'index.html'}")
 
+    report.write_json(cfg.output_dir / "run_report.json")
+    print(f"[info] report: {cfg.output_dir / 'run_report.json'}")
+    if cfg.metrics_file:
+        report.write_prometheus(cfg.metrics_file)
+        print(f"[info] metrics: {cfg.metrics_file}")
+
     print("[done]")
 
 
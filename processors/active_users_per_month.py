@@ -1,58 +1,118 @@
-from typing import Any, Dict, List
+from pathlib import Path
+from typing import Any, Dict, Union
+
+import numpy as np
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.sketch import HyperLogLog, hash64, save_hll
+from analyser.symbols import CodeCounts
+from analyser.table import MessageTable, month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
+# messages per (month id, from_id), or month id -> HyperLogLog sketch of its authors
+State = Union[CodeCounts, Dict[int, HyperLogLog]]
+
+# bucket of a month id, months per bucket
+PERIODS = {"month": 1, "quarter": 3, "year": 12}
+
 
 @register("active_users_per_month")
 class ActiveUsersPerMonth(BaseProcessor):
     """Line chart: unique from_id per month."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    columns = ("from_id",)
+    incremental = True
+    version = 2  # exact state: CodeCounts
+
+    def collect(self, table: MessageTable, **kwargs: Any) -> State:
+        """
+        Authors per month: exact (month, from_id) pairs, or with mode "hll" one HyperLogLog
+        sketch per month (`precision` bits of registers), whose memory does
+        not grow with the number of users.
+        """
+        mask = table.has_date & (table.from_id.codes >= 0)
+
+        if kwargs.get("mode", "exact") == "hll":
+            months = table.month[mask]
+            codes = np.asarray(table.from_id.codes)[mask]
+            cats = np.asarray(table.from_id.categories, dtype=object)
+            precision = int(kwargs.get("precision", 14))
+            uniq_months, month_pos = np.unique(months, return_inverse=True)
+            # each distinct from_id is hashed once, rows reuse its hash
+            idx, rank = HyperLogLog.positions(hash64(cats)[codes], precision)
+            regs = np.zeros((len(uniq_months), 1 << precision), dtype=np.uint8)
+            np.maximum.at(regs, (month_pos, idx), rank)
+            return {int(m): HyperLogLog(precision, r) for m, r in zip(uniq_months.tolist(), regs)}
+
+        return CodeCounts.of(table.month, table.from_id, mask=mask)
+
+    def merge(self, old: State, new: State) -> State:
+        if isinstance(old, CodeCounts):
+            return old.merge(new)
+        for m, users in new.items():
+            if m in old:
+                old[m].merge(users)
+            else:
+                old[m] = users
+        return old
+
+    def plot(self, state: State, **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "active_users_per_month.png")
-
-        rows: List[Dict[str, str]] = []
-        for m in messages:
-            date_str = m.get("date")
-            from_id = m.get("from_id")
-            if isinstance(date_str, str) and from_id is not None:
-                rows.append({"date": date_str, "from_id": str(from_id)})
-
-        if not rows:
-            return
-
-        df = pd.DataFrame(rows)
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.dropna(subset=["date"])
-
-        # Month buckets
-        df["month"] = df["date"].dt.to_period("M")
-
-        # Unique authors per month
-        monthly_unique = (
-            df.groupby("month")["from_id"].nunique().sort_index()
-        )
+        period: str = kwargs.get("period", "month")  # month | quarter | year
+        if period not in PERIODS:
+            raise ValueError(f"active_users_per_month: unknown period {period!r} (month, quarter or year)")
+        step = PERIODS[period]
+
+        # Unique authors per period: unions of the months it covers
+        sketch = not isinstance(state, CodeCounts)
+        if sketch:
+            buckets: Dict[int, HyperLogLog] = {}
+            for m in sorted(state):
+                b = m // step * step
+                if b in buckets:
+                    buckets[b].merge(state[m])
+                else:
+                    buckets[b] = HyperLogLog(state[m].precision, state[m].registers.copy())
+            monthly_unique = pd.Series({b: round(u.count()) for b, u in buckets.items()}, dtype="int64")
+        else:
+            pairs = np.unique(np.stack([state.column(0) // step * step, state.column(1)], axis=1), axis=0)
+            b, n = np.unique(pairs[:, 0], return_counts=True)
+            monthly_unique = pd.Series(n, index=b, dtype="int64")
+        monthly_unique = monthly_unique.sort_index()
 
         if monthly_unique.empty:
             return
 
-        x = monthly_unique.index.to_timestamp()
+        if sketch:
+            # the month sketches, for unions across chats without the messages
+            save_hll(self.output_dir / (Path(out_name).stem + ".hll.npz"),
+                     state)
+
+        x = month_starts(monthly_unique.index)
 
         # Plot
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
         ax.plot(x, monthly_unique.values, marker="o")
 
-        ax.xaxis.set_major_locator(mdates.MonthLocator(interval=3))
-        ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m"))
+        if period == "year":
+            ax.xaxis.set_major_locator(mdates.YearLocator())
+            ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y"))
+        else:
+            ax.xaxis.set_major_locator(mdates.MonthLocator(interval=3))
+            ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m"))
         fig.autofmt_xdate()
 
-        ax.set_title(f"Active users per month — {chat_name}")
-        ax.set_xlabel("Month")
+        title = f"Active users per {period} — {chat_name}"
+        if sketch:
+            title += " (HyperLogLog estimate)"
+        ax.set_title(title)
+        ax.set_xlabel(period.capitalize())
         ax.set_ylabel("Unique users")
         ax.grid(False)
 
@@ -1,11 +1,84 @@
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, FrozenSet, List, Tuple
+
+import pandas as pd
+
+from analyser.aggregate import Count, aggregate, merge_counts
+from analyser.table import MessageTable
 
 
 class BaseProcessor:
+    # Registry id, set by @register.
+    processor_id: str = ""
+    # Bump when the rendered charts change, to invalidate cached results.
+    version: int = 1
+    # Counters this processor needs; main.py feeds the counters of all
+    # configured processors in one aggregation pass per chat.
+    counts: Tuple[Count, ...] = ()
+    # True when collect()/merge()/plot() are implemented: the state of a
+    # chat is saved and later runs only fold the new messages into it.
+    incremental: bool = False
+    # True when the processor reads table.corpus: main.py tokenizes the
+    # chat once, before the processors are forked.
+    uses_corpus: bool = False
+    # Optional table columns read by this processor, its `counts` included
+    # (id and ts are always there); the loader only extracts the columns
+    # some configured processor declares.
+    columns: Tuple[str, ...] = ()
+
+    @classmethod
+    def prepare(cls, table: MessageTable, **kwargs: Any) -> None:
+        """
+        Called in the main process before the processors of a chat are
+        forked, with the same kwargs as run(): fill caches here that the
+        workers should inherit and later chats should reuse.
+        """
+
+    @classmethod
+    def required_columns(cls) -> FrozenSet[str]:
+        needed = set(cls.columns)
+        needed.update(c.weight for c in cls.counts if c.weight)
+        if cls.uses_corpus:
+            needed.add("text")
+        return frozenset(needed)
+
     def __init__(self, output_dir: Path, **kwargs: Any):
         self.output_dir = output_dir
         self.ctx = kwargs
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    def run(self, table: MessageTable, **kwargs: Any) -> None:
+        """
+        `table` is the chat's MessageTable, built once and shared by every
+        processor of the run: read from it, never modify it.
+
+        With a `state_store` in kwargs the collected state is saved; when
+        `resumed` is set the table only holds messages newer than the saved
+        state and is merged into it first.
+        """
+        state = self.collect(table, **kwargs)
+        store = kwargs.get("state_store")
+        if store is not None and self.incremental:
+            if kwargs.get("resumed"):
+                state = self.merge(store.load(self.processor_id), state)
+            store.save(self.processor_id, state)
+        self.plot(state, **kwargs)
+
+    def collect(self, table: MessageTable, **kwargs: Any) -> Any:
+        """Picklable aggregate of the table; by default the `counts` series."""
+        return self.counted(table, **kwargs)
+
+    def merge(self, old: Any, new: Any) -> Any:
+        """Combine the states of two consecutive slices of a chat."""
+        return merge_counts(self.counts, old, new)
+
+    def plot(self, state: Any, **kwargs: Any) -> None:
+        """Render the chart of a (possibly merged) state."""
         raise NotImplementedError
+
+    def counted(self, table: MessageTable, **kwargs: Any) -> List[pd.Series]:
+        """Finished series for `counts`, in order (computed here if main.py did not)."""
+        done = kwargs.get("aggregates") or {}
+        missing = [c for c in self.counts if c not in done]
+        if missing:
+            done = {**done, **aggregate(table, missing)}
+        return [done[c] for c in self.counts]
@@ -1,9 +1,11 @@
-from typing import Any, Dict, List
+from typing import Any
 
-import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.first_seen import FirstSeenIndex
+from analyser.table import MessageTable, month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
@@ -12,33 +14,27 @@ from .registry import register
 class FirstTimePostersOverTime(BaseProcessor):
     """Bar chart: count of users whose first message falls in each month."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
-        chat_name: str = kwargs.get("chat_name", "")
-        out_name: str = kwargs.get("output_name", "first_time_posters_over_time.png")
+    columns = ("from_id",)
+    incremental = True
+    version = 3  # state: FirstSeenIndex of SYMBOLS codes
 
-        rows: List[Dict[str, str]] = []
-        for m in messages:
-            date_str = m.get("date")
-            from_id = m.get("from_id")
-            if isinstance(date_str, str) and from_id is not None:
-                rows.append({"date": date_str, "from_id": str(from_id)})
+    def collect(self, table: MessageTable, **kwargs: Any) -> FirstSeenIndex:
+        """from_id -> timestamp of its first message, as a sorted index."""
+        return FirstSeenIndex.from_table(table)
 
-        if not rows:
-            return
+    def merge(self, old: FirstSeenIndex, new: FirstSeenIndex) -> FirstSeenIndex:
+        return old.update(new)
 
-        df = pd.DataFrame(rows)
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.dropna(subset=["date"])
-
-        # Первая дата сообщения для каждого пользователя
-        firsts = df.groupby("from_id")["date"].min()
+    def plot(self, state: FirstSeenIndex, **kwargs: Any) -> None:
+        chat_name: str = kwargs.get("chat_name", "")
+        out_name: str = kwargs.get("output_name", "first_time_posters_over_time.png")
 
         # Счётчик "новых авторов" по месяцам
-        monthly_new = firsts.groupby(firsts.dt.to_period("M")).size().sort_index()
+        monthly_new = state.new_per_month()
         if monthly_new.empty:
             return
 
-        x = monthly_new.index.to_timestamp()
+        x = month_starts(monthly_new.index)
 
         # Рисуем
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
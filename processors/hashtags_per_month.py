@@ -1,56 +1,40 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.aggregate import Count
+from analyser.table import MessageTable, month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
 
-def _count_hashtags(entities: Any) -> int:
-    """Count hashtag entities in Telegram's text_entities list."""
-    if not isinstance(entities, list):
-        return 0
-    count = 0
-    for e in entities:
-        if isinstance(e, dict) and e.get("type") == "hashtag":
-            count += 1
-    return count
+def _has_hashtags(table: MessageTable) -> np.ndarray:
+    return table.n_hashtags > 0
 
 
 @register("hashtags_per_month")
 class HashtagsPerMonth(BaseProcessor):
     """Line chart: number of hashtags per month."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    counts = (Count("month", where=_has_hashtags, weight="n_hashtags"),)
+    columns = ("n_hashtags",)
+    incremental = True
+
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "hashtags_per_month.png")
 
-        rows: List[Dict[str, Any]] = []
-        for m in messages:
-            date_str = m.get("date")
-            if not isinstance(date_str, str):
-                continue
-            cnt = _count_hashtags(m.get("text_entities"))
-            if cnt > 0:
-                rows.append({"date": date_str, "n": cnt})
-
-        if not rows:
-            return
-
-        df = pd.DataFrame(rows)
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.dropna(subset=["date"])
-        if df.empty:
-            return
-
-        df["month"] = df["date"].dt.to_period("M")
-        monthly = df.groupby("month")["n"].sum().sort_index()
+        (monthly,) = state
+        # only months that have hashtags
+        monthly = monthly[monthly > 0]
         if monthly.empty:
             return
 
-        x = monthly.index.to_timestamp()
+        x = month_starts(monthly.index)
 
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
         ax.plot(x, monthly.values, marker="o")
@@ -1,9 +1,13 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.aggregate import Count
+from analyser.table import MessageTable, month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
@@ -11,60 +15,38 @@ JOIN_ACTIONS = {"invite", "join_group_by_link", "migrate_to_supergroup"}
 LEAVE_ACTIONS = {"remove_member", "leave", "kick_user", "kick"}
 
 
-@register("join_leave_events_per_month")
-class JoinLeaveEventsPerMonth(BaseProcessor):
-    """Two-line chart: joins vs leaves per month."""
-
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
-        chat_name: str = kwargs.get("chat_name", "")
-        out_name: str = kwargs.get("output_name", "join_leave_events_per_month.png")
-
-        join_dates: List[str] = []
-        leave_dates: List[str] = []
+def _is_join(table: MessageTable) -> np.ndarray:
+    return table.service_rows(*JOIN_ACTIONS)
 
-        for m in messages:
-            if m.get("type") != "service":
-                continue
-            action = str(m.get("action") or "")
-            date_str = m.get("date")
-            if not isinstance(date_str, str):
-                continue
 
-            if action in JOIN_ACTIONS:
-                join_dates.append(date_str)
-            if action in LEAVE_ACTIONS:
-                leave_dates.append(date_str)
+def _is_leave(table: MessageTable) -> np.ndarray:
+    return table.service_rows(*LEAVE_ACTIONS)
 
-        if not join_dates and not leave_dates:
-            return
 
-        # Parse to datetime
-        jd = pd.to_datetime(join_dates, errors="coerce")
-        ld = pd.to_datetime(leave_dates, errors="coerce")
+@register("join_leave_events_per_month")
+class JoinLeaveEventsPerMonth(BaseProcessor):
+    """Two-line chart: joins vs leaves per month."""
 
-        # Convert to monthly PeriodIndex
-        pj = jd.dropna().to_period("M")
-        pl = ld.dropna().to_period("M")
+    counts = (Count("month", where=_is_join), Count("month", where=_is_leave))
+    columns = ("type", "action")
+    incremental = True
 
-        if len(pj) == 0 and len(pl) == 0:
-            return
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
+        chat_name: str = kwargs.get("chat_name", "")
+        out_name: str = kwargs.get("output_name", "join_leave_events_per_month.png")
 
-        # Build continuous monthly index from min to max period
-        start = min([p for p in [pj.min() if len(pj) else None,
-                                 pl.min() if len(pl) else None] if p is not None], default=None)
-        end = max([p for p in [pj.max() if len(pj) else None,
-                               pl.max() if len(pl) else None] if p is not None], default=None)
-        if start is None or end is None:
+        s_j, s_l = state
+        if s_j.empty and s_l.empty:
             return
 
-        all_idx = pd.period_range(start=start, end=end, freq="M")
-
-        # Monthly counts reindexed to full range
-        s_j = pj.value_counts().reindex(all_idx, fill_value=0).sort_index()
-        s_l = pl.value_counts().reindex(all_idx, fill_value=0).sort_index()
+        # Monthly counts over the full range from min to max month
+        all_idx = s_j.index.union(s_l.index)
+        all_idx = np.arange(all_idx.min(), all_idx.max() + 1)
+        s_j = s_j.reindex(all_idx, fill_value=0)
+        s_l = s_l.reindex(all_idx, fill_value=0)
 
         # X-axis as timestamps
-        x = all_idx.to_timestamp()
+        x = month_starts(all_idx)
 
         # Plot
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
@@ -1,58 +1,82 @@
-from typing import Any, Dict, List
+from typing import Any, Union
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from analyser.sketch import HeavyHitters, chunk_counts
+from analyser.symbols import CodeCounts
+from analyser.table import MessageTable
+
 from .base import BaseProcessor
 from .registry import register
 
-
-def _extract_mentions(entities: Any) -> List[str]:
-    """Извлекает @упоминания из text_entities."""
-    out: List[str] = []
-    if isinstance(entities, list):
-        for e in entities:
-            if isinstance(e, dict) and e.get("type") in ("mention", "mention_name"):
-                t = e.get("text")
-                if isinstance(t, str) and t.strip():
-                    out.append(t.strip())
-    return out
+# exact counts per handle or, in sketch mode, a bounded top-k summary
+State = Union[CodeCounts, HeavyHitters]
 
 
 @register("mentions_per_user")
 class MentionsPerUser(BaseProcessor):
     """Horizontal bar: most mentioned handles (@user)."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    columns = ("mentions",)
+    incremental = True
+    version = 2  # state: CodeCounts
+
+    def collect(self, table: MessageTable, **kwargs: Any) -> State:
+        """
+        Mentions per handle: exact, or with mode "sketch" a bounded top-k
+        summary (sketch_size handles, counts over-estimated by at most
+        mentions / sketch_size) for exports with too many handles.
+        """
+        # @упоминания уже извлечены из text_entities при сборке таблицы
+        codes = np.asarray(table.mentions.codes)
+        handles = np.asarray(table.mentions.categories, dtype=object)
+        if kwargs.get("mode", "exact") == "sketch":
+            hh = HeavyHitters(int(kwargs.get("sketch_size", 1000)), float(kwargs.get("sketch_eps", 1e-4)),
+                              float(kwargs.get("sketch_delta", 0.01)))
+            for part in chunk_counts(codes, handles):
+                hh.update(part)
+            return hh
+        return CodeCounts.of(table.mentions)
+
+    def merge(self, old: State, new: State) -> State:
+        return old.merge(new)
+
+    def plot(self, state: State, **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         top_n: int = int(kwargs.get("top_n", 20))
         out_name: str = kwargs.get("output_name", "mentions_per_user.png")
 
-        rows: List[Dict[str, Any]] = []
-        for m in messages:
-            for handle in _extract_mentions(m.get("text_entities")):
-                rows.append({"handle": handle, "cnt": 1})
-
-        if not rows:
-            return
-
-        df = pd.DataFrame(rows)
-        agg = (
-            df.groupby("handle", as_index=False)["cnt"]
-            .sum()
-            .sort_values("cnt", ascending=False)
-            .head(top_n)
-        )
+        sketch = isinstance(state, HeavyHitters)
+        if sketch:
+            top = state.top(top_n)
+            agg = pd.DataFrame({"handle": [k for k, _, _ in top], "cnt": [c for _, c, _ in top],
+                                "low": [lo for _, _, lo in top]})
+        else:
+            agg = (
+                pd.DataFrame({"handle": state.labels(0), "cnt": state.counts})
+                .sort_values(["cnt", "handle"], ascending=[False, True])
+                .head(top_n)
+            )
 
         if agg.empty:
             return
 
         fig_height = max(6, 0.45 * len(agg))
         fig, ax = plt.subplots(figsize=(14, fig_height), dpi=150)
-        ax.barh(agg["handle"], agg["cnt"])
+        if sketch:
+            # estimate, whisker down to the guaranteed lower bound
+            ax.barh(agg["handle"].astype(str), agg["cnt"],
+                    xerr=[agg["cnt"] - agg["low"], np.zeros(len(agg))], capsize=3)
+        else:
+            ax.barh(agg["handle"].astype(str), agg["cnt"])
         ax.invert_yaxis()
 
-        ax.set_title(f"Mentions per user — {chat_name}")
+        title = f"Mentions per user — {chat_name}"
+        if sketch:
+            title += f" (approx., error ≤ {state.bound})"
+        ax.set_title(title)
         ax.set_xlabel("Mentions")
         ax.set_ylabel("Handle")
         ax.grid(False)
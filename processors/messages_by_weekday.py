@@ -1,8 +1,10 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from analyser.aggregate import Count
+
 from .base import BaseProcessor
 from .registry import register
 
@@ -11,26 +13,19 @@ from .registry import register
 class MessagesByWeekday(BaseProcessor):
     """Bar chart of messages by weekday (Mon–Sun)."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    counts = (Count("weekday"),)
+    incremental = True
+
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "messages_by_weekday.png")
 
-        # Parse dates
-        dates = pd.to_datetime(
-            [m.get("date") for m in messages if isinstance(m.get("date"), str)],
-            errors="coerce",
-        ).dropna()
+        # Count messages per weekday (0=Mon ... 6=Sun)
+        (by_wd,) = state
 
-        if len(dates) == 0:
+        if by_wd.sum() == 0:
             return
 
-        dates = pd.DatetimeIndex(dates)
-
-        # Count messages per weekday (0=Mon ... 6=Sun)
-        s = pd.Series(1, index=dates)
-        by_wd = s.groupby(s.index.dayofweek).sum()
-        by_wd = by_wd.reindex(range(7), fill_value=0)
-
         # Plot
         labels = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
         fig, ax = plt.subplots(figsize=(10, 5), dpi=150)
@@ -1,8 +1,10 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from analyser.aggregate import Count
+
 from .base import BaseProcessor
 from .registry import register
 
@@ -11,27 +13,20 @@ from .registry import register
 class MessagesPerHour(BaseProcessor):
     """Bar chart: messages by hour of day (0–23)."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    counts = (Count("hour"),)
+    incremental = True
+
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "messages_per_hour.png")
 
         # Даты сообщений
-        dates = pd.to_datetime(
-            [m["date"] for m in messages if isinstance(m.get("date"), str)],
-            errors="coerce"
-        ).dropna()
+        # Количество сообщений по часам
+        (counts,) = state
 
-        if dates.empty:
+        if counts.sum() == 0:
             return
 
-        # Количество сообщений по часам
-        counts = (
-            pd.Series(1, index=dates, dtype="int64")
-            .groupby(dates.hour)
-            .sum()
-            .reindex(range(24), fill_value=0)
-        )
-
         # Рисуем
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
         ax.bar(counts.index, counts.values)
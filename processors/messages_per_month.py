@@ -1,9 +1,12 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.aggregate import Count
+from analyser.table import month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
@@ -12,32 +15,20 @@ from .registry import register
 class MessagesPerMonthV2(BaseProcessor):
     """Bar chart of messages per month (chronological)."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    counts = (Count("month"),)
+    incremental = True
+
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "messages_per_month.png")
 
-        # Parse dates
-        dates = pd.to_datetime(
-            [m.get("date") for m in messages if isinstance(m.get("date"), str)],
-            errors="coerce"
-        ).dropna()
+        # Count per month over a continuous range (zeros for gaps)
+        (s,) = state
 
-        if dates.empty:
+        if s.empty:
             return
 
-        # Count per month
-        s = (
-            pd.Series(1, index=dates, dtype="int64")
-            .groupby(dates.to_period("M"))
-            .sum()
-            .sort_index()
-        )
-
-        # Ensure continuous monthly range (show zeros for gaps)
-        all_idx = pd.period_range(start=s.index.min(), end=s.index.max(), freq="M")
-        s = s.reindex(all_idx, fill_value=0)
-
-        x = s.index.to_timestamp()
+        x = month_starts(s.index)
 
         # Plot
         fig, ax = plt.subplots(figsize=(14, 6), dpi=150)
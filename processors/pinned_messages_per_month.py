@@ -1,49 +1,39 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.aggregate import Count
+from analyser.table import MessageTable, month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
 
+def _is_pin(table: MessageTable) -> np.ndarray:
+    return table.service_rows("pin_message")
+
+
 @register("pinned_messages_per_month")
 class PinnedMessagesPerMonth(BaseProcessor):
     """Bar chart: action='pin_message' per month."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    counts = (Count("month", where=_is_pin),)
+    columns = ("type", "action")
+    incremental = True
+
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "pinned_messages_per_month.png")
 
-        # Собираем даты пинов
-        dates_raw: List[str] = []
-        for m in messages:
-            if m.get("type") == "service" and m.get("action") == "pin_message":
-                d = m.get("date")
-                if isinstance(d, str):
-                    dates_raw.append(d)
-
-        if not dates_raw:
+        # Счётчик пинов по месяцам, непрерывный диапазон (нули в пропусках)
+        (s,) = state
+        if s.empty:
             return
 
-        dates = pd.to_datetime(dates_raw, errors="coerce").dropna()
-        if dates.empty:
-            return
-
-        # Счётчик пинов по месяцам
-        s = (
-            pd.Series(1, index=dates, dtype="int64")
-            .groupby(dates.to_period("M"))
-            .sum()
-            .sort_index()
-        )
-
-        # Непрерывный месячный диапазон (заполним нулями)
-        all_idx = pd.period_range(start=s.index.min(), end=s.index.max(), freq="M")
-        s = s.reindex(all_idx, fill_value=0)
-
-        x = s.index.to_timestamp()
+        x = month_starts(s.index)
 
         # Рисуем
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
@@ -1,59 +1,53 @@
-from typing import Any, Dict, List
+from typing import Any, List
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from analyser.aggregate import Count
+from analyser.table import MessageTable, month_starts
+
 from .base import BaseProcessor
 from .registry import register
 
 
+def _is_message(table: MessageTable) -> np.ndarray:
+    return table.by_type.rows_of("message")
+
+
+def _is_service(table: MessageTable) -> np.ndarray:
+    return table.by_type.rows_of("service")
+
+
 @register("ratio_service_vs_message_over_time")
 class RatioServiceVsMessageOverTime(BaseProcessor):
     """100% stacked area: monthly share of service vs message."""
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    counts = (Count("month", where=_is_message), Count("month", where=_is_service))
+    columns = ("type",)
+    incremental = True
+
+    def plot(self, state: List[pd.Series], **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         out_name: str = kwargs.get("output_name", "ratio_service_vs_message_over_time.png")
 
-        rows: List[Dict[str, str]] = []
-        for m in messages:
-            date_str = m.get("date")
-            typ = m.get("type")
-            if isinstance(date_str, str) and isinstance(typ, str):
-                rows.append({"date": date_str, "type": typ})
-
-        if not rows:
+        s_msg, s_srv = state
+        if s_msg.empty and s_srv.empty:
             return
 
-        df = pd.DataFrame(rows)
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.dropna(subset=["date"])
-        if df.empty:
-            return
-
-        df["month"] = df["date"].dt.to_period("M")
-
-        # Счётчики по месяцам/типам
-        counts = (
-            df.pivot_table(index="month", columns="type", values="date", aggfunc="size", fill_value=0)
-            .sort_index()
-        )
-
-        # Полный месячный диапазон + фиксируем порядок колонок
-        all_idx = pd.period_range(start=counts.index.min(), end=counts.index.max(), freq="M")
-        counts = (
-            counts.reindex(all_idx, fill_value=0)
-            .reindex(columns=["message", "service"], fill_value=0)
-        )
-
-        if counts.empty:
-            return
+        # Счётчики по месяцам/типам на полном месячном диапазоне
+        all_idx = s_msg.index.union(s_srv.index)
+        all_idx = np.arange(all_idx.min(), all_idx.max() + 1)
+        counts = pd.DataFrame({
+            "message": s_msg.reindex(all_idx, fill_value=0),
+            "service": s_srv.reindex(all_idx, fill_value=0),
+        })
 
         totals = counts.sum(axis=1).replace(0, 1)
         share = counts.divide(totals, axis=0)
 
-        x = share.index.to_timestamp()
+        x = month_starts(share.index)
 
         # Рисуем 100% stacked area
         fig, ax = plt.subplots(figsize=(12, 5), dpi=150)
@@ -1,12 +1,60 @@
-from typing import Dict, Type
+import importlib
+from typing import Dict, Iterator, Mapping, Type
 from .base import BaseProcessor
 
-REGISTRY: Dict[str, Type[BaseProcessor]] = {}
+# processor id -> module that registers it; keep in sync when adding processors
+MODULES: Dict[str, str] = {
+    "active_users_per_month": "processors.active_users_per_month",
+    "average_message_length_per_month": "processors.average_message_length_per_month",
+    "first_time_posters_over_time": "processors.first_time_posters_over_time",
+    "hashtags_per_month": "processors.hashtags_per_month",
+    "join_leave_events_per_month": "processors.join_leave_events_per_month",
+    "mentions_per_user": "processors.mentions_per_user",
+    "messages_by_weekday": "processors.messages_by_weekday",
+    "messages_per_hour": "processors.messages_per_hour",
+    "messages_per_month": "processors.messages_per_month",
+    "pinned_messages_per_month": "processors.pinned_messages_per_month",
+    "ratio_service_vs_message_over_time": "processors.ratio_service_vs_message_over_time",
+    "top_users_by_messages_from_id": "processors.top_users_by_messages_from_id",
+    "topics_nmf": "processors.topics_nmf",
+    "wordcloud_top_words": "processors.wordcloud_top_words",
+}
+
+
+class LazyRegistry(Mapping[str, Type[BaseProcessor]]):
+    """
+    Processor id -> class, importing a processor's module on first lookup.
+
+    Only configured processors pay for their dependencies (sklearn,
+    wordcloud, ...); `in` and iteration never import anything.
+    """
+
+    def __init__(self, modules: Dict[str, str]):
+        self.modules = modules
+        self.classes: Dict[str, Type[BaseProcessor]] = {}
+
+    def __getitem__(self, name: str) -> Type[BaseProcessor]:
+        if name not in self.classes:
+            importlib.import_module(self.modules[name])
+        return self.classes[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.modules or name in self.classes
+
+    def __iter__(self) -> Iterator[str]:
+        return iter({**self.modules, **self.classes})
+
+    def __len__(self) -> int:
+        return len({**self.modules, **self.classes})
+
+
+REGISTRY = LazyRegistry(MODULES)
 
 
 def register(name: str):
     def deco(cls: Type[BaseProcessor]):
-        REGISTRY[name] = cls
+        cls.processor_id = name
+        REGISTRY.classes[name] = cls
         return cls
 
     return deco
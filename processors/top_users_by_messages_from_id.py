@@ -1,17 +1,43 @@
-from typing import Any, Dict, List
+from collections import Counter
+from typing import Any, Dict, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from analyser.sketch import HeavyHitters, chunk_counts
+from analyser.symbols import CodeCounts
+from analyser.table import MessageTable
+
 from .base import BaseProcessor
 from .registry import register
 
+# (messages per from_id, messages per (from_id, 'from') pair); in sketch
+# mode a bounded top-k summary and the names of the ids it monitors
+State = Union[Tuple[CodeCounts, CodeCounts], Tuple[HeavyHitters, Dict[str, Counter]]]
+
 
 def _trim_label(s: str, max_len: int = 40) -> str:
     s = (s or "").replace("\n", " ").strip()
     return (s[: max_len - 1] + "…") if len(s) > max_len else s
 
 
+def _count_names(seen: Dict[str, Counter], id_codes: np.ndarray, name_codes: np.ndarray,
+                 ids: np.ndarray, names: np.ndarray) -> None:
+    """Add the (from_id, from) pairs of the rows to `seen`, one key per pair."""
+    keep = name_codes >= 0
+    key = id_codes[keep].astype(np.int64) * max(1, len(names)) + name_codes[keep]
+    uniq, n = np.unique(key, return_counts=True)
+    i, j = np.divmod(uniq, max(1, len(names)))
+    for uid, name, k in zip(ids[i].tolist(), names[j].tolist(), n.tolist()):
+        seen.setdefault(uid, Counter())[name] += k
+
+
+def _drop_unmonitored(seen: Dict[str, Counter], hh: HeavyHitters) -> None:
+    for uid in [u for u in seen if u not in hh.summary.counts]:
+        del seen[uid]
+
+
 @register("top_users_by_messages_from_id")
 class TopUsersByMessagesFromId(BaseProcessor):
     """
@@ -19,48 +45,79 @@ class TopUsersByMessagesFromId(BaseProcessor):
     Label uses the most frequent 'from' per id (fallback to empty).
     """
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    columns = ("type", "from_id", "from_name")
+    incremental = True
+    version = 2  # exact state: CodeCounts
+
+    def collect(self, table: MessageTable, **kwargs: Any) -> State:
+        """Message and name counts per from_id; mode "sketch" bounds them to sketch_size ids."""
+        rows = table.by_type.rows_of("message")
+        rows = rows[np.asarray(table.from_id.codes)[rows] >= 0]
+
+        if kwargs.get("mode", "exact") == "sketch":
+            ids = np.asarray(table.from_id.categories, dtype=object)
+            names = np.asarray(table.from_name.categories, dtype=object)
+            id_codes = np.asarray(table.from_id.codes)[rows]
+            name_codes = np.asarray(table.from_name.codes)[rows]
+            hh = HeavyHitters(int(kwargs.get("sketch_size", 1000)), float(kwargs.get("sketch_eps", 1e-4)),
+                              float(kwargs.get("sketch_delta", 0.01)))
+            seen: Dict[str, Counter] = {}
+            chunk = 1 << 20
+            for start, part in zip(range(0, len(id_codes), chunk), chunk_counts(id_codes, ids, chunk)):
+                hh.update(part)
+                _count_names(seen, id_codes[start:start + chunk], name_codes[start:start + chunk], ids, names)
+                _drop_unmonitored(seen, hh)
+            return hh, seen
+
+        # Кол-во сообщений на from_id и на пару (from_id, имя)
+        return CodeCounts.of(table.from_id, mask=rows), CodeCounts.of(table.from_id, table.from_name, mask=rows)
+
+    def merge(self, old: State, new: State) -> State:
+        if isinstance(old[0], CodeCounts):
+            return old[0].merge(new[0]), old[1].merge(new[1])
+        old[0].merge(new[0])
+        for uid, names in new[1].items():
+            old[1].setdefault(uid, Counter()).update(names)
+        _drop_unmonitored(old[1], old[0])
+        return old
+
+    def plot(self, state: State, **kwargs: Any) -> None:
         chat_name: str = kwargs.get("chat_name", "")
         top_n: int = int(kwargs.get("top_n", 20))
         out_name: str = kwargs.get("output_name", "top_users_by_messages_from_id.png")
 
-        rows: List[Dict[str, str]] = []
-        for m in messages:
-            if m.get("type") != "message":
-                continue
-            fid = m.get("from_id")
-            if fid is None:
-                continue
-            rows.append({
-                "from_id": str(fid),
-                "from": (m.get("from") or "").strip(),
+        cnt, seen = state
+        sketch = isinstance(cnt, HeavyHitters)
+        if sketch:
+            top = cnt.top(top_n)
+            low = {uid: lo for uid, _, lo in top}
+
+            # Самое частое имя на from_id (при равенстве — лексикографически первое)
+            def most_frequent_name(uid: str) -> str:
+                names = seen.get(uid)
+                return min(names.items(), key=lambda kv: (-kv[1], kv[0]))[0] if names else ""
+
+            frame = pd.DataFrame({
+                "from_id": [uid for uid, _, _ in top],
+                "cnt": [c for _, c, _ in top],
+                "display_name": [most_frequent_name(uid) for uid, _, _ in top],
             })
-
-        if not rows:
+        else:
+            # labels only now, for the ids and names of the chart
+            pairs = (
+                pd.DataFrame({"from_id": seen.labels(0), "name": seen.labels(1), "n": seen.counts})
+                .sort_values(["n", "name"], ascending=[False, True])
+                .drop_duplicates("from_id")
+                .set_index("from_id")["name"]
+            )
+            frame = pd.DataFrame({"from_id": cnt.labels(0), "cnt": cnt.counts})
+            frame["display_name"] = frame["from_id"].map(pairs).fillna("")
+        if frame.empty:
             return
 
-        df = pd.DataFrame(rows)
-
-        # Кол-во сообщений на from_id
-        cnt = df["from_id"].value_counts().rename_axis("from_id").rename("cnt").to_frame()
-
-        # Самое частое имя на from_id (mode; устойчиво при тай-брейке)
-        def most_frequent_name(s: pd.Series) -> str:
-            mode = s.mode(dropna=True)
-            return str(mode.iloc[0]) if len(mode) else ""
-
-        names = (
-            df.groupby("from_id")["from"]
-            .apply(most_frequent_name)
-            .rename("display_name")
-            .to_frame()
-        )
-
         agg = (
-            cnt.join(names, how="left")
-            .fillna({"display_name": ""})
-            .reset_index()
-            .sort_values(["cnt", "display_name"], ascending=[False, True])
+            frame
+            .sort_values(["cnt", "display_name", "from_id"], ascending=[False, True, True])
             .head(top_n)
         )
 
@@ -69,13 +126,23 @@ class TopUsersByMessagesFromId(BaseProcessor):
 
         fig_h = max(6.0, 0.5 * len(agg))
         fig, ax = plt.subplots(figsize=(14, fig_h), dpi=150)
-        bars = ax.barh(labels, agg["cnt"].values)
+        if sketch:
+            # estimate, whisker down to the guaranteed lower bound
+            lows = np.array([low[uid] for uid in agg["from_id"]])
+            bars = ax.barh(labels, agg["cnt"].values, xerr=[agg["cnt"].values - lows, np.zeros(len(agg))],
+                           capsize=3)
+        else:
+            bars = ax.barh(labels, agg["cnt"].values)
         ax.invert_yaxis()
 
         # Подписи чисел справа от полос
-        ax.bar_label(bars, labels=[str(v) for v in agg["cnt"].values], padding=4, label_type="edge")
+        prefix = "≈" if sketch else ""
+        ax.bar_label(bars, labels=[f"{prefix}{v}" for v in agg["cnt"].values], padding=4, label_type="edge")
 
-        ax.set_title(f"Top users by messages (from_id) — {chat_name}")
+        title = f"Top users by messages (from_id) — {chat_name}"
+        if sketch:
+            title += f" (approx., error ≤ {state[0].bound})"
+        ax.set_title(title)
         ax.set_xlabel("Messages")
         ax.set_ylabel("User")
         ax.grid(False)
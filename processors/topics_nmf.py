@@ -1,21 +1,31 @@
 # processors/topics_nmf.py
-from typing import Any, Dict, List, Iterable, Optional, Set
-import re
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Iterable, Iterator, Optional, Set, Union
+import hashlib
+import os
+import pickle
+import zlib
 from textwrap import fill
 
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 import numpy as np
-from sklearn.decomposition import NMF
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
+from sklearn.decomposition import NMF, MiniBatchNMF
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from analyser.corpus import Corpus, norm
+from analyser.table import MessageTable
 
 from .base import BaseProcessor
 from .registry import register
 
 # ------------------------- tokenization & stopwords -------------------------
 
-WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё]+(?:-[A-Za-zА-Яа-яЁё]+)?", re.U)
-
 RU_STOP: Set[str] = {
     "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так", "его", "но", "да",
     "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "мне", "было", "вот", "от", "меня", "еще", "нет",
@@ -37,34 +47,15 @@ TECH_STOP: Set[str] = {"http", "https", "www", "com", "org", "ru"}
 STOPWORDS: Set[str] = RU_STOP | EN_STOP | TECH_STOP
 
 
-def _norm(w: str) -> str:
-    return w.lower().replace("ё", "е")
+def plain_text_rows(table: MessageTable) -> np.ndarray:
+    """Rows of regular (type == "message") messages with visible text."""
+    rows = table.by_type.rows_of("message")
+    return rows[table.text_len[rows] > 0]
 
 
-def iter_plain_text(messages: Iterable[Dict[str, Any]]) -> Iterable[str]:
-    """Extract visible text from Telegram export messages."""
-    for m in messages:
-        if m.get("type") != "message":
-            continue
-        t = m.get("text")
-        if isinstance(t, str):
-            yield t
-        elif isinstance(t, list):
-            parts: List[str] = []
-            for p in t:
-                if isinstance(p, dict):
-                    txt = p.get("text")
-                    if isinstance(txt, str):
-                        parts.append(txt)
-                elif isinstance(p, str):
-                    parts.append(p)
-            if parts:
-                yield " ".join(parts)
-
-
-def simple_tokenize(s: str) -> List[str]:
-    """Split text into lowercase tokens using WORD_RE."""
-    return [_norm(w) for w in WORD_RE.findall(s)]
+def plain_text_months(table: MessageTable, rows: np.ndarray) -> np.ndarray:
+    """Month index of every row of `rows`; -1 when undated."""
+    return np.where(table.has_date[rows], table.month[rows], -1)
 
 
 # Optional lemmatization (auto-enabled if pymorphy2 is available).
@@ -72,37 +63,310 @@ try:
     import pymorphy2  # type: ignore
 
     _MORPH = pymorphy2.MorphAnalyzer()
+except Exception:
+    _MORPH = None
+
+
+LEMMA_CACHE_SIZE = 500_000
+
+
+class LemmaMap:
+    """
+    Word form -> lemma, each form parsed by pymorphy2 only once.
 
+    Holds at most `max_size` forms (the oldest are dropped first) and can be
+    saved to / merged from a pickle file, so chats of a run and later runs
+    share the forms already parsed.
+    """
 
-    def lemmatize(tokens: List[str]) -> List[str]:
-        out: List[str] = []
-        for w in tokens:
-            if w.isdigit():
-                continue
-            p = _MORPH.parse(w)
-            out.append(p[0].normal_form if p else w)
+    def __init__(self, max_size: int = LEMMA_CACHE_SIZE):
+        self.max_size = max_size
+        self.forms: Dict[str, str] = {}
+        self.loaded: Set[Path] = set()
+        self.added = 0
+
+    def resolve(self, words: Iterable[str]) -> Dict[str, str]:
+        """Lemmas of the unique `words`, parsing only unseen forms."""
+        out: Dict[str, str] = {}
+        for w in words:
+            lemma = self.forms.get(w)
+            if lemma is None:
+                p = _MORPH.parse(w)
+                lemma = self.forms[w] = p[0].normal_form if p else w
+                self.added += 1
+            out[w] = lemma
+        excess = len(self.forms) - self.max_size
+        if excess > 0:
+            for w in list(islice(self.forms, excess)):
+                del self.forms[w]
         return out
-except Exception:
-    _MORPH = None
 
+    def load(self, path: Path) -> None:
+        if path in self.loaded:
+            return
+        self.loaded.add(path)
+        try:
+            with path.open("rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        # forms parsed in this run are newer: keep them last
+        self.forms = {**saved, **self.forms}
 
-    def lemmatize(tokens: List[str]) -> List[str]:
-        return tokens
+    def save(self, path: Path) -> None:
+        if not self.added:
+            return
+        try:
+            with path.open("rb") as f:
+                merged = {**pickle.load(f), **self.forms}
+        except (OSError, pickle.UnpicklingError, EOFError):
+            merged = self.forms
+        merged = dict(islice(merged.items(), max(0, len(merged) - self.max_size), None))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(merged, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.added = 0
+
+
+@lru_cache(maxsize=None)
+def lemma_map(max_size: int = LEMMA_CACHE_SIZE) -> LemmaMap:
+    """The LemmaMap of this process holding up to `max_size` forms, shared by every chat."""
+    return LemmaMap(max_size)
+
+
+def vocab_terms(vocab: List[str], lemmas: Optional[LemmaMap], min_len: int, extra_stop: Set[str]) -> List[str]:
+    """
+    Term of every corpus token id after lemmatization (when `lemmas` is
+    given) and the length/stopword/digit filters; "" for dropped tokens.
+    Every distinct form is looked at once, whatever the number of its
+    occurrences.
+    """
+    sw = {norm(s) for s in (STOPWORDS | extra_stop)}
+    forms = vocab
+    if lemmas is not None:
+        resolved = lemmas.resolve(w for w in vocab if not w.isdigit())
+        forms = [resolved.get(w, w) for w in vocab]
+    return [w if len(w) >= min_len and w not in sw and not w.isdigit() else "" for w in forms]
 
 
-def preprocess(texts: List[str], use_lemma: bool, min_len: int, extra_stop: Set[str]) -> List[str]:
-    """Tokenize, optionally lemmatize, filter by length/stopwords/digits, then join."""
-    sw = {_norm(s) for s in (STOPWORDS | extra_stop)}
+def preprocess(corpus: Corpus, rows: Iterable[int], terms: List[str]) -> List[str]:
+    """Documents of `rows`: their kept terms joined by spaces."""
+    offsets = corpus.offsets
     out: List[str] = []
-    for t in texts:
-        toks = simple_tokenize(t)
-        if use_lemma:
-            toks = lemmatize(toks)
-        toks = [w for w in toks if len(w) >= min_len and w not in sw and not w.isdigit()]
-        out.append(" ".join(toks))
+    for r in rows:
+        ids = corpus.tokens[offsets[r]:offsets[r + 1]].tolist()
+        out.append(" ".join(filter(None, map(terms.__getitem__, ids))))
     return out
 
 
+def _doc_limit(v: Union[int, float], n_docs: int) -> float:
+    """min_df/max_df as TfidfVectorizer reads them: int = documents, float = share."""
+    return v * n_docs if isinstance(v, float) else v
+
+
+# ------------------------- document selection -------------------------
+
+# MinHash over the word set of a document, split into bands (LSH): two
+# documents share a band with probability ~ 1 - (1 - J^rows)^bands for
+# Jaccard similarity J, i.e. ~0.99 at J = 0.9, ~0.85 at J = 0.8, ~0.15 at
+# J = 0.5. Short documents have too few words for that to mean anything and
+# are only deduplicated exactly.
+_MH_BANDS, _MH_ROWS = 5, 5
+_NEAR_MIN_WORDS = 5
+_MH_PRIME = np.uint64((1 << 61) - 1)
+_mh_rng = np.random.RandomState(20240611)
+_MH_A = _mh_rng.randint(1, 1 << 31, size=(_MH_BANDS * _MH_ROWS, 1)).astype(np.uint64)
+_MH_B = _mh_rng.randint(0, 1 << 31, size=(_MH_BANDS * _MH_ROWS, 1)).astype(np.uint64)
+
+
+def _band_keys(tokens: List[str]) -> List[bytes]:
+    """LSH band keys of a non-empty token list."""
+    h = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in set(tokens)), dtype=np.uint64)
+    sig = ((_MH_A * h + _MH_B) % _MH_PRIME).min(axis=1).reshape(_MH_BANDS, _MH_ROWS)
+    return [bytes([b]) + row.tobytes() for b, row in enumerate(sig)]
+
+
+class DocFilter:
+    """
+    Pre-vectorization selection of preprocessed documents.
+
+    Drops documents with fewer than `min_tokens` tokens and, with `dedup`
+    set, repeats of a document seen before: "exact" compares the token
+    sequence, "near" additionally drops documents whose word set is
+    similar to a kept one (MinHash banding), which catches re-posted
+    vacancies and bot templates with small edits. The first occurrence
+    is kept.
+    """
+
+    def __init__(self, min_tokens: int = 0, dedup: str = "none"):
+        if dedup not in ("none", "exact", "near"):
+            raise ValueError(f"topics_nmf: unknown dedup {dedup!r} (none, exact or near)")
+        self.min_tokens = min_tokens
+        self.dedup = dedup
+        self._exact: Set[bytes] = set()
+        self._bands: Set[bytes] = set()
+
+    @property
+    def active(self) -> bool:
+        return self.min_tokens > 0 or self.dedup != "none"
+
+    def keep(self, doc: str) -> bool:
+        tokens = doc.split()
+        if len(tokens) < self.min_tokens:
+            return False
+        if self.dedup == "none":
+            return True
+        digest = hashlib.blake2b(doc.encode("utf-8"), digest_size=8).digest()
+        if digest in self._exact:
+            return False
+        if self.dedup == "near" and len(set(tokens)) >= _NEAR_MIN_WORDS:
+            keys = _band_keys(tokens)
+            if any(k in self._bands for k in keys):
+                return False
+            self._bands.update(keys)
+        self._exact.add(digest)
+        return True
+
+
+def stratified_sample(idx: np.ndarray, months: np.ndarray, budget: int, seed: int = 42) -> np.ndarray:
+    """
+    At most `budget` of the documents `idx`, each month represented in
+    proportion to its share (largest remainder, at least one document per
+    month while the budget allows). Returned in their original order.
+    """
+    if budget <= 0 or len(idx) <= budget:
+        return idx
+    groups, inverse, sizes = np.unique(months[idx], return_inverse=True, return_counts=True)
+    quota = sizes * (budget / len(idx))
+    take = np.floor(quota).astype(np.int64)
+    if len(groups) <= budget:
+        take = np.maximum(take, 1)
+    rest = budget - int(take.sum())
+    if rest > 0:
+        # largest remainders first, then the biggest months
+        order = np.lexsort((-sizes, -(quota - np.floor(quota))))
+        take[order[:rest]] += 1
+    elif rest < 0:
+        # the one-per-month floor overshot: trim the biggest quotas
+        for _ in range(-rest):
+            take[np.argmax(take)] -= 1
+    take = np.minimum(take, sizes)
+
+    rng = np.random.default_rng(seed)
+    picked = [rng.choice(np.flatnonzero(inverse == g), size=int(k), replace=False)
+              for g, k in enumerate(take) if k > 0]
+    return np.sort(idx[np.concatenate(picked)]) if picked else idx[:0]
+
+
+def topics_batch(
+        texts: List[str], n_topics: int, max_features: int, min_df: Any, max_df: Any, top_words: int,
+) -> List[List[str]]:
+    """Top words of every topic, strongest topic first: full TF-IDF + NMF in memory."""
+    vectorizer = TfidfVectorizer(
+        max_features=max_features,
+        min_df=min_df,
+        max_df=max_df,
+        tokenizer=str.split,
+        lowercase=False,
+        norm="l2",
+    )
+    X = vectorizer.fit_transform(texts)
+    if X.shape[0] == 0 or X.shape[1] == 0:
+        return []
+
+    nmf = NMF(n_components=n_topics, init="nndsvd", random_state=42, max_iter=500)
+    W = nmf.fit_transform(X)  # docs x topics
+    H = nmf.components_  # topics x terms
+    vocab = np.array(vectorizer.get_feature_names_out())
+
+    order = np.argsort(W.sum(axis=0))[::-1]
+    return [list(vocab[np.argsort(H[ti])[::-1][:top_words]]) for ti in order]
+
+
+def topics_online(
+        chunks: Callable[[], Iterator[List[str]]], n_topics: int, max_features: int, min_df: Any, max_df: Any,
+        n_features: int, batch_size: int, n_epochs: int, top_words: int,
+) -> List[List[str]]:
+    """
+    Same as topics_batch in bounded memory, streaming `chunks()` a few times.
+
+    Documents are hashed (HashingVectorizer) instead of building a
+    vocabulary; a first pass collects document frequencies for the IDF
+    weights and the min_df/max_df/max_features cuts, then MiniBatchNMF is
+    fitted with partial_fit for `n_epochs` passes. A last pass measures
+    topic strength and names the top hashed features of each topic with
+    their most frequent word.
+    """
+    hv = HashingVectorizer(
+        n_features=n_features, tokenizer=str.split, token_pattern=None,
+        lowercase=False, alternate_sign=False, norm=None,
+    )
+
+    # pass 1: document / term frequencies per hashed feature
+    df = np.zeros(n_features, dtype=np.int64)
+    tf = np.zeros(n_features, dtype=np.float64)
+    n_docs = 0
+    for docs in chunks():
+        X = hv.transform(docs)
+        df += np.bincount(X.indices, minlength=n_features)
+        tf += np.bincount(X.indices, weights=X.data, minlength=n_features)
+        n_docs += X.shape[0]
+    if n_docs == 0:
+        return []
+
+    keep = (df > 0) & (df >= _doc_limit(min_df, n_docs)) & (df <= _doc_limit(max_df, n_docs))
+    if keep.sum() > max_features:
+        cut = np.argsort(np.where(keep, tf, -1.0), kind="stable")[::-1][:max_features]
+        keep = np.zeros_like(keep)
+        keep[cut] = True
+    # the model only sees the kept features, in a compact column space
+    cols = np.flatnonzero(keep)
+    if cols.size == 0:
+        return []
+    weigh = sparse.diags(np.log((1 + n_docs) / (1 + df[cols])) + 1.0)
+
+    def tfidf(docs: List[str]) -> sparse.csr_matrix:
+        X = normalize(hv.transform(docs)[:, cols] @ weigh, norm="l2")
+        return X[X.getnnz(axis=1) > 0]
+
+    # pass 2..: online NMF
+    nmf = MiniBatchNMF(n_components=n_topics, init="nndsvda", batch_size=batch_size, random_state=42)
+    fitted = False
+    for _ in range(max(1, n_epochs)):
+        for docs in chunks():
+            X = tfidf(docs)
+            if X.shape[0] >= (1 if fitted else n_topics):
+                nmf.partial_fit(X)
+                fitted = True
+    if not fitted:
+        return []
+    H = nmf.components_
+
+    # last pass: topic strength and the words behind the top features
+    top = {int(cols[f]) for ti in range(n_topics) for f in np.argsort(H[ti])[::-1][:top_words]}
+    strength = np.zeros(n_topics)
+    seen: Dict[int, Counter] = {}
+    for docs in chunks():
+        X = tfidf(docs)
+        if X.shape[0]:
+            strength += nmf.transform(X).sum(axis=0)
+        words = Counter(w for d in docs for w in d.split())
+        uniq = list(words)
+        if not uniq:
+            continue
+        hashed = hv.transform(uniq).indices  # one feature per single-word document
+        for w, f in zip(uniq, hashed.tolist()):
+            if f in top:
+                seen.setdefault(f, Counter())[w] += words[w]
+
+    names = {f: c.most_common(1)[0][0] for f, c in seen.items()}
+    order = np.argsort(strength)[::-1]
+    return [[names[int(cols[f])] for f in np.argsort(H[ti])[::-1][:top_words] if int(cols[f]) in names]
+            for ti in order]
+
+
 def _clip_word(w: str, max_len: int) -> str:
     """Prevent ultra-long tokens from breaking layout."""
     if len(w) <= max_len:
@@ -121,15 +385,42 @@ class TopicsNMF(BaseProcessor):
     - adaptive figure size (no overflow).
     """
 
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    columns = ("type", "text_len")
+    uses_corpus = True
+
+    @staticmethod
+    def lemmas(kwargs: Dict[str, Any]) -> Optional[LemmaMap]:
+        """Lemma map for these settings (lemma_cache_file merged in once); None without lemmatization."""
+        if not kwargs.get("use_lemmatization", False) or _MORPH is None:
+            return None
+        lemmas = lemma_map(int(kwargs.get("lemma_cache_size", LEMMA_CACHE_SIZE)))
+        if kwargs.get("lemma_cache_file"):
+            lemmas.load(Path(kwargs["lemma_cache_file"]))
+        return lemmas
+
+    @classmethod
+    def prepare(cls, table: MessageTable, **kwargs: Any) -> None:
+        """
+        Parse the chat's word forms in the main process: forked workers
+        inherit the filled map, and the next chats only parse new forms.
+        """
+        lemmas = cls.lemmas(kwargs)
+        if lemmas is None or not len(table):
+            return
+        lemmas.resolve(w for w in table.corpus.vocab if not w.isdigit())
+        if kwargs.get("lemma_cache_file"):
+            lemmas.save(Path(kwargs["lemma_cache_file"]))
+
+    def run(self, table: MessageTable, **kwargs: Any) -> None:
         # ---- parameters ----
         n_topics: int = int(kwargs.get("n_topics", 8))
         max_features: int = int(kwargs.get("max_features", 30000))
         min_df = kwargs.get("min_df", 3)
         max_df: float = float(kwargs.get("max_df", 0.9))
-        use_lemma: bool = bool(kwargs.get("use_lemmatization", False))
         min_len: int = int(kwargs.get("min_len", 3))
         extra_stop: Set[str] = {str(s).lower() for s in kwargs.get("stopwords", [])}
+        lemma_cache_file: Optional[str] = kwargs.get("lemma_cache_file")  # parsed forms kept between runs
+        lemmas = self.lemmas(kwargs)  # None unless use_lemmatization and pymorphy2 is installed
 
         topk_table: int = int(kwargs.get("topk_table", 5))  # how many strongest topics
         table_words: int = max(1, int(kwargs.get("table_words", 8)))
@@ -139,41 +430,74 @@ class TopicsNMF(BaseProcessor):
         title: Optional[str] = kwargs.get("title")
         out_name: str = kwargs.get("out_name", "topics_nmf.png")
 
+        # batch: exact, everything in memory; online: streamed in chunks with
+        # bounded memory; auto: online from online_min_docs texts on
+        mode: str = str(kwargs.get("mode", "batch")).lower()
+        batch_size: int = max(1, int(kwargs.get("batch_size", 4096)))
+        n_features: int = int(kwargs.get("n_features", 1 << 18))
+        n_epochs: int = int(kwargs.get("n_epochs", 3))
+        online_min_docs: int = int(kwargs.get("online_min_docs", 200_000))
+
+        # selection before vectorization; NMF then scales with max_docs,
+        # not with the size of the chat
+        min_tokens: int = int(kwargs.get("min_tokens", 0))  # after stopwords/min_len
+        dedup: str = str(kwargs.get("dedup", "none")).lower()  # none | exact | near
+        max_docs: int = int(kwargs.get("max_docs", 0))  # 0 = no sampling
+        sample_seed: int = int(kwargs.get("sample_seed", 42))
+        doc_filter = DocFilter(min_tokens, dedup)
+        if mode not in ("batch", "online", "auto"):
+            raise ValueError(f"topics_nmf: unknown mode {mode!r} (batch, online or auto)")
+
         # ---- data ----
-        texts = list(iter_plain_text(messages))
-        if not texts:
+        rows = plain_text_rows(table)
+        n_texts = len(rows)
+        if not n_texts:
             print("[topics_nmf] No texts; nothing to process")
             return
-        cleaned = preprocess(texts, use_lemma, min_len, extra_stop)
-
-        vectorizer = TfidfVectorizer(
-            max_features=max_features,
-            min_df=min_df,
-            max_df=max_df,
-            tokenizer=str.split,
-            lowercase=False,
-            norm="l2",
-        )
-        X = vectorizer.fit_transform(cleaned)
-        if X.shape[0] == 0 or X.shape[1] == 0:
+        corpus = table.corpus
+        terms = vocab_terms(corpus.vocab, lemmas, min_len, extra_stop)
+
+        def chunks(selected: Optional[np.ndarray] = None) -> Iterator[List[str]]:
+            picked = rows if selected is None else rows[selected]
+            for start in range(0, len(picked), batch_size):
+                yield preprocess(corpus, picked[start:start + batch_size], terms)
+
+        selected: Optional[np.ndarray] = None
+        n_docs = n_texts
+        if doc_filter.active or 0 < max_docs < n_texts:
+            keep = np.ones(n_texts, dtype=bool)
+            if doc_filter.active:
+                keep = np.fromiter((doc_filter.keep(d) for docs in chunks() for d in docs),
+                                   dtype=bool, count=n_texts)
+            idx = stratified_sample(np.flatnonzero(keep), plain_text_months(table, rows), max_docs, sample_seed)
+            selected = np.zeros(n_texts, dtype=bool)
+            selected[idx] = True
+            n_docs = len(idx)
+            print(f"[topics_nmf] {n_texts} texts -> {int(keep.sum())} after min_tokens/dedup "
+                  f"-> {n_docs} documents")
+            if not n_docs:
+                print("[topics_nmf] No documents left after selection")
+                return
+
+        if mode == "online" or (mode == "auto" and n_docs >= online_min_docs):
+            topics = topics_online(lambda: chunks(selected), n_topics, max_features, min_df, max_df,
+                                   n_features, batch_size, n_epochs, table_words)
+        else:
+            cleaned = [d for docs in chunks(selected) for d in docs]
+            topics = topics_batch(cleaned, n_topics, max_features, min_df, max_df, table_words)
+        if lemmas is not None and lemma_cache_file:
+            lemmas.save(Path(lemma_cache_file))
+        if not topics:
             print("[topics_nmf] Empty matrix after vectorization")
             return
 
-        nmf = NMF(n_components=n_topics, init="nndsvd", random_state=42, max_iter=500)
-        W = nmf.fit_transform(X)  # docs x topics
-        H = nmf.components_  # topics x terms
-        vocab = np.array(vectorizer.get_feature_names_out())
-
         # strongest topics
-        topic_strength = W.sum(axis=0)
         k = max(1, min(topk_table, n_topics))
-        top_idx = np.argsort(topic_strength)[::-1][:k]
 
         # lines (one per topic), pre-wrapped
         lines: List[str] = []
-        for rank, ti in enumerate(top_idx, start=1):
-            idx = np.argsort(H[ti])[::-1][:table_words]
-            words = [_clip_word(w, max_word_len) for w in vocab[idx]]
+        for rank, topic_words in enumerate(topics[:k], start=1):
+            words = [_clip_word(w, max_word_len) for w in topic_words]
             raw = f"{rank}. " + ", ".join(words)
             wrapped = fill(raw, width=wrap_chars, break_long_words=False, break_on_hyphens=False)
             lines.append(wrapped)
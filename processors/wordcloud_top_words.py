@@ -1,16 +1,24 @@
-from typing import Any, Dict, List, Iterable
+from typing import Any, Dict, List, Iterable, Set, Tuple
 from collections import Counter
-import re
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+from pathlib import Path
+import heapq
+import multiprocessing as mp
+import os
+import pickle
+import tempfile
 
 import matplotlib.pyplot as plt
 from matplotlib import font_manager
 from wordcloud import WordCloud
 
+from analyser.corpus import WORD_RE, norm
+from analyser.table import MessageTable
+
 from .base import BaseProcessor
 from .registry import register
 
-WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё]+(?:-[A-Za-zА-Яа-яЁё]+)?", re.U)
-
 BUILTIN_STOPWORDS = {
     "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так", "его", "но", "да",
     "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "мне", "было", "вот", "от", "меня", "еще", "нет",
@@ -29,60 +37,148 @@ BUILTIN_STOPWORDS = {
 }
 
 
-def _norm(w: str) -> str:
-    return w.lower().replace("ё", "е")
-
-
-def iter_plain_text(messages: Iterable[Dict[str, Any]]) -> Iterable[str]:
-    for m in messages:
-        t = m.get("text")
-        if isinstance(t, str):
+def iter_plain_text(table: MessageTable) -> Iterable[str]:
+    for t in table.text:
+        if t:
             yield t
-        elif isinstance(t, list):
-            chunks: List[str] = []
-            for part in t:
-                if isinstance(part, dict):
-                    txt = part.get("text")
-                    if isinstance(txt, str):
-                        chunks.append(txt)
-                elif isinstance(part, str):
-                    chunks.append(part)
-            if chunks:
-                yield " ".join(chunks)
 
 
 def tokenize(text: str) -> List[str]:
-    return [_norm(w) for w in WORD_RE.findall(text)]
+    return [norm(w) for w in WORD_RE.findall(text)]
+
+
+def count_words(texts: Iterable[str], min_len: int, stopwords: Set[str]) -> Counter:
+    """Map step: frequencies of the words that pass the filters."""
+    cnt: Counter = Counter()
+    for text in texts:
+        if text:
+            cnt.update(w for w in tokenize(text) if len(w) >= min_len and w not in stopwords and not w.isdigit())
+    return cnt
+
+
+def prune(cnt: Counter, min_freq: int, max_rare: int = 0) -> Counter:
+    """Words used at least min_freq times, plus the max_rare most frequent of the rarer ones."""
+    if min_freq <= 1:
+        return cnt
+    kept = Counter({k: v for k, v in cnt.items() if v >= min_freq})
+    if max_rare > 0 and len(kept) < len(cnt):
+        rare = ((k, v) for k, v in cnt.items() if v < min_freq)
+        kept.update(dict(heapq.nlargest(max_rare, rare, key=itemgetter(1))))
+    return kept
+
+
+# Chat being counted; forked workers inherit it instead of receiving texts.
+_SHARED: Dict[str, Any] = {}
+
+
+def _map_chunk(job: Tuple[int, int, int]) -> None:
+    """Count rows [start, stop) and spill the counts split into word partitions."""
+    chunk, start, stop = job
+    cnt = count_words(_SHARED["texts"][start:stop], _SHARED["min_len"], _SHARED["stopwords"])
+    n_parts: int = _SHARED["n_parts"]
+    parts: List[Dict[str, int]] = [{} for _ in range(n_parts)]
+    for w, c in cnt.items():
+        # str hashes agree between forked workers (same hash seed)
+        parts[hash(w) % n_parts][w] = c
+    for i, part in enumerate(parts):
+        with (_SHARED["spill"] / f"{chunk}.{i}.pkl").open("wb") as f:
+            pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _reduce_part(part: int) -> Counter:
+    """Merge one word partition over all chunks; prune it before returning."""
+    total: Counter = Counter()
+    for chunk in range(_SHARED["n_chunks"]):
+        path = _SHARED["spill"] / f"{chunk}.{part}.pkl"
+        with path.open("rb") as f:
+            total.update(pickle.load(f))
+        path.unlink()
+    return prune(total, _SHARED["min_freq"], _SHARED["max_rare"])
+
+
+def count_parallel(
+        texts: Any, min_len: int, stopwords: Set[str], min_freq: int, workers: int, chunk_size: int,
+        max_rare: int = 0,
+) -> Counter:
+    """
+    Map-reduce word count in forked workers.
+
+    Map: row ranges of `texts` are counted and spilled to a temporary
+    directory, split into `workers` partitions by word hash. Reduce: each
+    partition is merged over all chunks and pruned to `min_freq` (keeping
+    its share of `max_rare` rarer words) in its worker, so no process ever
+    holds the whole unpruned vocabulary; only the surviving words come back.
+    """
+    bounds = [(i, min(i + chunk_size, len(texts))) for i in range(0, len(texts), chunk_size)]
+    jobs = [(n, start, stop) for n, (start, stop) in enumerate(bounds)]
+    with tempfile.TemporaryDirectory(prefix="tg-wordcount-") as spill:
+        _SHARED.update(texts=texts, min_len=min_len, stopwords=stopwords, min_freq=min_freq,
+                       max_rare=-(-max_rare // workers), n_parts=workers, n_chunks=len(jobs), spill=Path(spill))
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("fork")) as pool:
+                list(pool.map(_map_chunk, jobs))
+                total: Counter = Counter()
+                for part in pool.map(_reduce_part, range(workers)):
+                    total.update(part)
+            return total
+        finally:
+            _SHARED.clear()
 
 
 @register("wordcloud_top_words")
 class WordsCloudTopWords(BaseProcessor):
-    def run(self, messages: List[Dict[str, Any]], **kwargs: Any) -> None:
+    # reads table.corpus only when another processor had it built: the
+    # corpus keeps every distinct word, the counters below only frequent ones
+    columns = ("text",)
+    incremental = True
+
+    def collect(self, table: MessageTable, **kwargs: Any) -> Counter:
+        """Word frequencies after the filters, pruned to min_freq (see state_rare_words)."""
+        min_len: int = int(kwargs.get("min_len", 2))
+        extra_stop = {norm(s) for s in kwargs.get("stopwords", [])}
+        stopwords = {norm(s) for s in BUILTIN_STOPWORDS} | extra_stop
+        # 0 = the CPUs left to this processor by the runner's pool (at least one);
+        # chats below parallel_min_texts are counted here
+        runner_workers: int = max(1, int(kwargs.get("runner_workers", 1)))
+        workers: int = int(kwargs.get("count_workers", 0)) or max(1, (os.cpu_count() or 1) // runner_workers)
+        chunk_size: int = max(1, int(kwargs.get("chunk_size", 100_000)))
+        parallel_min_texts: int = int(kwargs.get("parallel_min_texts", 200_000))
+
+        min_freq: int = int(kwargs.get("min_freq", 2))
+        # a saved state also keeps this many rarer words: they may pass min_freq later
+        max_rare: int = self.max_rare(kwargs)
+
+        if "corpus" in table.__dict__:
+            # already tokenized for topics_nmf: one bincount, filters once per distinct word
+            corpus = table.corpus
+            return prune(Counter({
+                w: n for w, n in zip(corpus.vocab, corpus.term_counts().tolist())
+                if n and len(w) >= min_len and w not in stopwords and not w.isdigit()
+            }), min_freq, max_rare)
+        if workers > 1 and len(table.text) >= parallel_min_texts and "fork" in mp.get_all_start_methods():
+            return count_parallel(table.text, min_len, stopwords, min_freq, workers, chunk_size, max_rare)
+        return prune(count_words(iter_plain_text(table), min_len, stopwords), min_freq, max_rare)
+
+    @staticmethod
+    def max_rare(kwargs: Dict[str, Any]) -> int:
+        if kwargs.get("state_store") is None:
+            return 0
+        return int(kwargs.get("state_rare_words", 100_000))
+
+    def merge(self, old: Counter, new: Counter) -> Counter:
+        old.update(new)
+        return prune(old, int(self.ctx.get("min_freq", 2)), self.max_rare(self.ctx))
+
+    def plot(self, state: Counter, **kwargs: Any) -> None:
         max_words: int = int(kwargs.get("max_words", 300))
         min_freq: int = int(kwargs.get("min_freq", 2))
         width: int = int(kwargs.get("width", 1600))
         height: int = int(kwargs.get("height", 900))
         background_color: str = kwargs.get("background_color", "white")
         font_path: str | None = kwargs.get("font_path")
-        min_len: int = int(kwargs.get("min_len", 2))
         out_name: str = kwargs.get("out_name", "wordcloud_top_words.png")
 
-        extra_stop = {_norm(s) for s in kwargs.get("stopwords", [])}
-        stopwords = {_norm(s) for s in BUILTIN_STOPWORDS} | extra_stop
-
-        cnt = Counter()
-        for text in iter_plain_text(messages):
-            for w in tokenize(text):
-                if len(w) < min_len:
-                    continue
-                if w in stopwords:
-                    continue
-                if w.isdigit():
-                    continue
-                cnt[w] += 1
-
-        if min_freq > 1:
-            cnt = Counter({k: v for k, v in cnt.items() if v >= min_freq})
+        cnt = prune(state, min_freq)
 
         if not cnt:
             print("[wordcloud_top_words] No words passed filters; nothing to plot")